@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import imp
+import json
+import time
+import random
+import shutil
+import platform
+import resource
+import tempfile
+import argparse
+import itertools
+import multiprocessing
+PARSE_LOGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse-logs.py")
+TO_MEGA = 1024*1024
+START_TIMESTAMP = 1000000000
+PARENT_PID = 1000
+STAGES = ("parse", "covered_interval", "nearest_matching", "peak_selection", "reporting")
+# Every combination of these values is one case of the default suite.
+DEFAULT_SNAPSHOTS = (1000, 10000)
+DEFAULT_CHILDREN = (1, 4, 12)
+DEFAULT_DEPTHS = (1, 8)
+
+
+def load_parse_logs():
+    return imp.load_source("parse_logs", PARSE_LOGS)
+
+
+def write_heap_tree(lines, generator, total, depth, indent):
+    # Splits total between at most three callers per level, like massif does with --depth.
+    function = generator.randrange(500)
+    description = "0x%X: Qt::function%d(QString const&, int) (qfile%d.cpp:%d)" \
+                  % (0x400000 + function * 16, function, function % 40, function)
+    if depth <= 1 or total < 64:
+        lines.append("%sn0: %d %s" % (" " * indent, total, description))
+        return
+    children = generator.randint(1, 3)
+    lines.append("%sn%d: %d %s" % (" " * indent, children, total, description))
+    rest = total
+    for child in range(children):
+        size = rest if child == children - 1 else generator.randint(0, rest)
+        rest -= size
+        write_heap_tree(lines, generator, size, depth - 1, indent + 1)
+
+
+def generate_massif_file(file_name, generator, snapshots, start, end, depth, detailed_frequency, size=None):
+    # Writes one massif output file with snapshots evenly spread between start and end.
+    # With size more snapshots follow at the same interval, past end, until the file
+    # is at least size bytes long.
+    interval = max((end - start) // max(snapshots - 1, 1), 1)
+    memory = generator.randint(TO_MEGA, 10 * TO_MEGA)
+    peak_id = None
+    peak_memory = -1
+    written = 0
+    snapshot_id = 0
+    with open(file_name, "w") as massif_file:
+        massif_file.write("desc: --time-unit=ms --depth=%d\ncmd: ./Minimal synthetic\ntime_unit: ms\n" % depth)
+        while snapshot_id < snapshots or (size is not None and written < size):
+            memory = max(memory + generator.randint(-TO_MEGA // 4, TO_MEGA // 4), 0)
+            timestamp = start + snapshot_id * interval + generator.randint(0, interval // 2)
+            lines = ["#-----------", "snapshot=%d" % snapshot_id, "#-----------",
+                     "time=%d" % (timestamp - start), "timestamp=%d" % timestamp,
+                     "mem_heap_B=%d" % memory, "mem_heap_extra_B=%d" % (memory // 20), "mem_stacks_B=0"]
+            if snapshot_id % detailed_frequency == 0 or memory > peak_memory:
+                lines.append("heap_tree=%s" % ("detailed" if snapshot_id % detailed_frequency == 0 else "peak"))
+                lines.append("n3: %d (heap allocation functions) malloc/new/new[], --alloc-fns, etc." % memory)
+                for part in (memory // 2, memory // 4, memory - memory // 2 - memory // 4):
+                    write_heap_tree(lines, generator, part, depth, 1)
+            else:
+                lines.append("heap_tree=empty")
+            if memory > peak_memory:
+                peak_id = snapshot_id
+                peak_memory = memory
+            text = "\n".join(lines) + "\n"
+            massif_file.write(text)
+            written += len(text)
+            snapshot_id += 1
+    return peak_id
+
+
+def generate_measurement(directory, case):
+    # One parent and case["children"] child processes of run 1, the children
+    # cover case["overlap"] of the lifetime of the parent.
+    generator = random.Random(case["seed"])
+    duration = case["duration"] * 1000000
+    file_names = [os.path.join(directory, "1-.out%d" % PARENT_PID)]
+    generate_massif_file(file_names[0], generator, case["snapshots"], START_TIMESTAMP, START_TIMESTAMP + duration,
+                         case["depth"], case["detailed_frequency"], case["size"])
+    child_duration = int(duration * case["overlap"])
+    for child in range(case["children"]):
+        child_start = START_TIMESTAMP + generator.randint(1, max(duration - child_duration, 1))
+        file_names.append(os.path.join(directory, "1-.out%d" % (PARENT_PID + child + 1)))
+        generate_massif_file(file_names[-1], generator, case["snapshots"], child_start,
+                             child_start + child_duration, case["depth"], case["detailed_frequency"], case["size"])
+    return file_names
+
+
+def run_stages(parse_logs, file_names):
+    timings = {}
+    started = time.time()
+    output_list = [parse_logs.MassifOutput(file_name) for file_name in file_names]
+    timings["parse"] = time.time() - started
+
+    stage_starts = []
+    result_generator = parse_logs.ResultGenerator(
+        output_list, lambda stage: stage_starts.append((stage, time.time())))
+    for (stage, started), (next_stage, ended) in zip(stage_starts, stage_starts[1:]):
+        timings[stage] = ended - started
+
+    started = time.time()
+    parse_logs.format_result_verbosity_2(result_generator.get_chosen_snapshots(), output_list,
+                                         result_generator.get_chosen_sources())
+    parse_logs.build_result_record(result_generator)
+    timings["reporting"] = time.time() - started
+    return timings, result_generator.get_useful_memory()
+
+
+def run_case(case):
+    # Runs in a fresh worker process, so the peak RSS belongs to this case only.
+    parse_logs = load_parse_logs()
+    directory = tempfile.mkdtemp(prefix="massif-benchmark-")
+    try:
+        file_names = generate_measurement(directory, case)
+        total_bytes = sum(os.path.getsize(file_name) for file_name in file_names)
+        best = {}
+        peak_memory = None
+        for repeat in range(case["repeat"]):
+            timings, peak_memory = run_stages(parse_logs, file_names)
+            for stage, seconds in timings.items():
+                best[stage] = min(best.get(stage, seconds), seconds)
+    finally:
+        shutil.rmtree(directory)
+    result = dict(case)
+    result["files"] = len(file_names)
+    result["input_bytes"] = total_bytes
+    result["result_peak_B"] = peak_memory
+    result["seconds"] = dict((stage, round(best[stage], 6)) for stage in STAGES)
+    result["total_seconds"] = round(sum(best.values()), 6)
+    result["parse_MiB_per_s"] = round(float(total_bytes) / TO_MEGA / best["parse"], 3) if best["parse"] else None
+    # ru_maxrss is in KiB on Linux.
+    result["peak_rss_KiB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def get_cases(arguments):
+    cases = []
+    for snapshots, children, depth in itertools.product(arguments.snapshots, arguments.children, arguments.depth):
+        cases.append({"name": "s%d-c%d-d%d" % (snapshots, children, depth),
+                      "snapshots": snapshots,
+                      "children": children,
+                      "depth": depth,
+                      "overlap": arguments.overlap,
+                      "duration": arguments.duration,
+                      "detailed_frequency": arguments.detailed_frequency,
+                      "size": arguments.size * TO_MEGA if arguments.size else None,
+                      "seed": arguments.seed,
+                      "repeat": arguments.repeat})
+    return cases
+
+
+def format_comparison(result, baseline):
+    string = "%s:" % result["name"]
+    for stage in STAGES + ("total",):
+        if stage == "total":
+            current, previous = result["total_seconds"], baseline["total_seconds"]
+        else:
+            current, previous = result["seconds"][stage], baseline["seconds"][stage]
+        ratio = float(current) / previous if previous else float("inf")
+        string += " %s %.3fs (x%.2f)" % (stage, current, ratio)
+    string += " rss %d KiB (x%.2f)" % (result["peak_rss_KiB"],
+                                       float(result["peak_rss_KiB"]) / baseline["peak_rss_KiB"])
+    return string
+
+
+def read_baseline(file_name):
+    baseline = {}
+    with open(file_name, "r") as baseline_file:
+        for line in baseline_file:
+            if line.strip():
+                result = json.loads(line)
+                baseline[result["name"]] = result
+    return baseline
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks the parse-logs.py analysis stages on synthetic "
+                                                 "massif files, without valgrind or Qt.")
+    parser.add_argument("--snapshots", type=int, nargs="+", default=DEFAULT_SNAPSHOTS,
+                        help="snapshots per process (default: %(default)s)")
+    parser.add_argument("--children", type=int, nargs="+", default=DEFAULT_CHILDREN,
+                        help="child processes (default: %(default)s)")
+    parser.add_argument("--depth", type=int, nargs="+", default=DEFAULT_DEPTHS,
+                        help="heap tree depth (default: %(default)s)")
+    parser.add_argument("--overlap", type=float, default=0.8,
+                        help="part of the parent lifetime covered by every child (default: %(default)s)")
+    parser.add_argument("--duration", type=int, default=60,
+                        help="seconds covered by the parent process (default: %(default)s)")
+    parser.add_argument("--detailed-frequency", type=int, default=10,
+                        help="every Nth snapshot has a heap tree (default: %(default)s)")
+    parser.add_argument("--size", type=int, metavar="MiB",
+                        help="grow every file to at least this size, overrides the snapshot count")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generator (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="the best time of this many repeats is reported (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="append the JSON line of every case to this file")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="print the time and memory ratios against the results in this file")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    baseline = read_baseline(arguments.compare) if arguments.compare else {}
+    output = open(arguments.output, "a") if arguments.output else None
+    parser_version = load_parse_logs().PARSER_VERSION
+    for case in get_cases(arguments):
+        pool = multiprocessing.Pool(1)
+        result = pool.apply(run_case, (case,))
+        pool.close()
+        pool.join()
+        result["python"] = platform.python_version()
+        result["parser_version"] = parser_version
+        line = json.dumps(result, sort_keys=True)
+        if output is not None:
+            output.write(line + "\n")
+            output.flush()
+        if result["name"] in baseline:
+            sys.stdout.write(format_comparison(result, baseline[result["name"]]) + "\n")
+        else:
+            sys.stdout.write(line + "\n")
+    if output is not None:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
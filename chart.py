@@ -3,9 +3,131 @@
 import sys
 import os
 import re
-import plotly
-from plotly.graph_objs import Scatter, Bar, Box, Layout, Data
-from plotly.figure_factory import create_table
+import csv
+import json
+import math
+import hashlib
+import sqlite3
+import argparse
+import collections
+import multiprocessing
+from xml.sax.saxutils import escape
+TO_MEGA = 1024*1024
+STRUCTURED_RESULT_EXTENSIONS = (".jsonl", ".csv")
+# The structured records are used when a site was measured in several formats.
+RESULT_FORMAT_PREFERENCE = (".jsonl", ".csv", ".txt")
+RESULT_FILE_PATTERN = ".*\.(txt|jsonl|csv)$"
+DATABASE_VERSION = 1
+DEFAULT_DATABASE_NAME = ".results.sqlite"
+DEFAULT_DASHBOARD_DIR = "dashboard"
+# Bootstrap means of this many result sets are computed at once, it bounds the memory use.
+BOOTSTRAP_BLOCK = 64
+REGRESSION_EXIT_CODE = 3
+PLOTLY_JS_NAME = "plotly.min.js"
+MANIFEST_NAME = ".charts-manifest.json"
+# Has to be increased whenever the figures of the same results change, it rebuilds every figure.
+FIGURES_VERSION = 1
+BACKENDS = ("plotly", "svg")
+SVG_WIDTH = 900
+SVG_HEIGHT = 500
+# Left, top, right (legend) and bottom margins of the plot area.
+SVG_MARGINS = (80, 50, 170, 60)
+SVG_TABLE_ROW_HEIGHT = 22
+# The default trace colors of plotly.
+SVG_COLORS = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+              "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf")
+# Lists the static figures of every site, the images are only loaded when scrolled into view.
+SVG_INDEX_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Memory consumption</title>
+<style>
+body { font-family: sans-serif; }
+img { display: block; margin: 0.5em 0; }
+</style>
+</head>
+<body>
+%(sites)s
+</body>
+</html>
+"""
+# Shows the list of the sites, and loads data/<site>.js with the figures of a site
+# only when the site is selected.
+DASHBOARD_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Memory consumption</title>
+<script src="%(plotly_js)s"></script>
+<style>
+body { display: flex; margin: 0; font-family: sans-serif; }
+#sites { width: 16em; height: 100vh; overflow-y: auto; border-right: 1px solid #ccc; }
+#sites a { display: block; padding: 0.2em 0.5em; color: black; text-decoration: none; }
+#sites a.selected { background: #ddd; }
+#figures { flex: 1; height: 100vh; overflow-y: auto; }
+</style>
+</head>
+<body>
+<div id="sites"></div>
+<div id="figures"></div>
+<script>
+var sites = %(sites)s;
+var loadedFigures = {};
+function showFigures(site) {
+    var container = document.getElementById("figures");
+    container.innerHTML = "";
+    loadedFigures[site].forEach(function (figure) {
+        var div = document.createElement("div");
+        container.appendChild(div);
+        Plotly.newPlot(div, figure.data, figure.layout);
+    });
+}
+function loadSiteFigures(site, figures) {
+    loadedFigures[site] = figures;
+    if (location.hash.substring(1) === encodeURIComponent(site)) {
+        showFigures(site);
+    }
+}
+function selectSite(site) {
+    Array.prototype.forEach.call(document.querySelectorAll("#sites a"), function (link) {
+        link.className = link.textContent === site ? "selected" : "";
+    });
+    if (site in loadedFigures) {
+        showFigures(site);
+        return;
+    }
+    var script = document.createElement("script");
+    script.src = "data/" + encodeURIComponent(site) + ".js";
+    document.head.appendChild(script);
+}
+sites.forEach(function (site) {
+    var link = document.createElement("a");
+    link.textContent = site;
+    link.href = "#" + encodeURIComponent(site);
+    document.getElementById("sites").appendChild(link);
+});
+window.onhashchange = function () {
+    selectSite(decodeURIComponent(location.hash.substring(1)));
+};
+if (location.hash) {
+    window.onhashchange();
+} else if (sites.length) {
+    location.hash = encodeURIComponent(sites[0]);
+}
+</script>
+</body>
+</html>
+"""
+# Fields of a result record written by parse-logs.py --format json/csv and their accepted types.
+RESULT_RECORD_FIELDS = {
+    "run": (int, type(None)),
+    "peak_B": (int,),
+    "peak_extra_B": (int,),
+    "coverage_percent": (int, float),
+    "parent_pid": (int, type(None)),
+    "child_pids": (list,),
+}
 
 
 class MeasureResult(object):
@@ -42,55 +164,278 @@ class MeasureResult(object):
         return True
 
 
-def get_benchmark_list(dir_name):
-    files_per_version = {}
-    for root, dirs, filenames in os.walk(dir_name):
-        if re.match("\./$", root):
-            continue
-        files_per_version[root] = []
-        for filename in filenames:
-            files_per_version[root].append(filename)
-    return files_per_version
+def parse_result_path(path):
+    gpu = None
+    engine = None
+    site = None
+    version = None
+    for part in path.split(os.sep):
+        if re.match(".*QtWebkit.*", part):
+            name_and_version = part.split("-")
+            if name_and_version[0] == "Intel" or name_and_version[0] == "Nvidia":
+                gpu = name_and_version[0]
+                engine = name_and_version[1]
+                if len(name_and_version) is 3:
+                    engine += "-" + name_and_version[2]
+            else:
+                engine = part
+        if re.match(".*QtWebEngine.*", part):
+            name_and_version = part.split("-")
+            if name_and_version[0] == "Intel" or name_and_version[0] == "Nvidia":
+                gpu = name_and_version[0]
+                engine = name_and_version[1]
+                version = name_and_version[2]
+            else:
+                engine = name_and_version[0]
+                version = name_and_version[1]
+        if re.match(RESULT_FILE_PATTERN, part):
+            site = part.split(".")[0]
+    return gpu, engine, version, site
+
+
+def result_path_matches(path, filters, complete=False):
+    # Directories only mismatch in the values their path already determines.
+    gpu, engine, version, site = parse_result_path(path)
+    values = {"gpu": gpu, "engine": engine, "version": version}
+    for key, value in values.items():
+        if filters.get(key) is not None and filters[key] != value and (complete or value is not None):
+            return False
+    return True
+
+
+def get_format_preference(path):
+    return RESULT_FORMAT_PREFERENCE.index(os.path.splitext(path)[1])
+
+
+# SQLite store of the result files of one results tree. Every result file is
+# indexed by site, engine, version and GPU, and is only read again if its
+# size or modification time changed since the last ingest.
+class ResultsDatabase(object):
+    FILTERS = ("engine", "version", "gpu")
+
+    def __init__(self, database_name):
+        self.connection = sqlite3.connect(database_name)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != DATABASE_VERSION:
+            self.connection.executescript("""
+                DROP TABLE IF EXISTS result_files;
+                DROP TABLE IF EXISTS runs;
+                PRAGMA user_version = %d;
+            """ % DATABASE_VERSION)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS result_files (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, root TEXT, size INTEGER, mtime REAL,
+                site TEXT, engine TEXT, version TEXT, gpu TEXT, errors INTEGER);
+            CREATE TABLE IF NOT EXISTS runs (file_id INTEGER, run INTEGER, memory REAL);
+            CREATE INDEX IF NOT EXISTS result_files_query ON result_files (site, engine, version, gpu);
+            CREATE INDEX IF NOT EXISTS runs_file ON runs (file_id);
+        """)
+
+    def close(self):
+        self.connection.close()
+
+    def ingest(self, dir_name, filters=None, site=None):
+        # Only the directories and result files that can match filters and site are walked.
+        filters = filters or {}
+        where, values = self._where(filters, site)
+        known_files = {}
+        for file_id, path, size, mtime in self.connection.execute(
+                "SELECT id, path, size, mtime FROM result_files" + where, values):
+            known_files[path] = (file_id, size, mtime)
+        ingested_files = 0
+        found_paths = set()
+        for root, dirs, filenames in os.walk(dir_name):
+            dirs[:] = [directory for directory in dirs
+                       if result_path_matches(os.path.relpath(os.path.join(root, directory), dir_name), filters)]
+            for filename in filenames:
+                if not re.match(RESULT_FILE_PATTERN, filename):
+                    continue
+                if site is not None and filename.split(".")[0] != site:
+                    continue
+                full_path = os.path.join(root, filename)
+                path = os.path.relpath(full_path, dir_name)
+                if not result_path_matches(path, filters, True):
+                    continue
+                found_paths.add(path)
+                stat = os.stat(full_path)
+                if path in known_files and known_files[path][1:] == (stat.st_size, stat.st_mtime):
+                    continue
+                memories, amount_of_errors = read_memories(full_path)
+                self._store(path, stat, memories, amount_of_errors, known_files.get(path))
+                ingested_files += 1
+        for path in set(known_files) - found_paths:
+            self._delete(known_files[path][0])
+        # Removed roots outside of the walked part of the tree.
+        for file_id, root in self.connection.execute("SELECT id, root FROM result_files").fetchall():
+            if not os.path.isdir(os.path.join(dir_name, root)):
+                self._delete(file_id)
+        self.connection.commit()
+        return ingested_files
+
+    def _delete(self, file_id):
+        self.connection.execute("DELETE FROM runs WHERE file_id = ?", (file_id,))
+        self.connection.execute("DELETE FROM result_files WHERE id = ?", (file_id,))
+
+    def _store(self, path, stat, memories, amount_of_errors, known_file):
+        if known_file is not None:
+            self._delete(known_file[0])
+        gpu, engine, version, site = parse_result_path(path)
+        cursor = self.connection.execute(
+            "INSERT INTO result_files (path, root, size, mtime, site, engine, version, gpu, errors) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, os.path.dirname(path), stat.st_size, stat.st_mtime, site, engine, version, gpu,
+             amount_of_errors))
+        self.connection.executemany("INSERT INTO runs (file_id, run, memory) VALUES (?, ?, ?)",
+                                    [(cursor.lastrowid, run, memory) for run, memory in enumerate(memories)])
+
+    def _where(self, filters, site=None):
+        conditions = []
+        values = []
+        if site is not None:
+            conditions.append("site = ?")
+            values.append(site)
+        for key in self.FILTERS:
+            if filters.get(key) is not None:
+                conditions.append("%s = ?" % key)
+                values.append(filters[key])
+        if not conditions:
+            return "", values
+        return " WHERE " + " AND ".join(conditions), values
+
+    def get_roots(self, filters):
+        where, values = self._where(filters)
+        return [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT root FROM result_files" + where + " ORDER BY root", values)]
+
+    def get_sites(self, filters):
+        where, values = self._where(filters)
+        return [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT site FROM result_files" + where + " ORDER BY site", values)]
+
+    def get_results(self, site, filters):
+        # One (root, gpu, engine, version, errors, memories) tuple per root measuring the site. If a
+        # root has the site in several formats, the first of RESULT_FORMAT_PREFERENCE is used.
+        where, values = self._where(filters, site)
+        files = collections.OrderedDict()
+        for file_id, path, root, gpu, engine, version, errors, memory in self.connection.execute(
+                "SELECT result_files.id, path, root, gpu, engine, version, errors, memory "
+                "FROM result_files LEFT JOIN runs ON runs.file_id = result_files.id" + where +
+                " ORDER BY root, result_files.id, run", values):
+            if file_id not in files:
+                files[file_id] = (path, (root, gpu, engine, version, errors, []))
+            if memory is not None:
+                files[file_id][1][5].append(memory)
+        results = collections.OrderedDict()
+        for path, result in files.values():
+            root = result[0]
+            if root in results:
+                used_path, used_result = results[root]
+                if get_format_preference(path) < get_format_preference(used_path):
+                    path, used_path = used_path, path
+                    results[root] = (used_path, result)
+                sys.stderr.write("%s is ignored, %s has the results of the same site\n" % (path, used_path))
+                continue
+            results[root] = (path, result)
+        return [result for path, result in results.values()]
+
 
+def validate_result_record(record, file_name, line_number):
+    if not isinstance(record, dict):
+        raise ValueError("%s:%d: the result record is not an object" % (file_name, line_number))
+    if record.get("error"):
+        return record
+    for field, types in RESULT_RECORD_FIELDS.items():
+        if field not in record:
+            raise ValueError("%s:%d: the %s field is missing" % (file_name, line_number, field))
+        if not isinstance(record[field], types) or isinstance(record[field], bool):
+            raise ValueError("%s:%d: the %s field has a wrong type" % (file_name, line_number, field))
+    return record
 
-def is_measured_with_every_version(file_name, file_vectors):
-    exists_in_every_version = True
-    for files in file_vectors:
-        if file_name not in files:
-            exists_in_every_version = False
-    return exists_in_every_version
 
+def _parse_csv_row(row):
+    record = {}
+    for field, value in row.items():
+        if field in ("run", "peak_B", "peak_extra_B", "parent_pid"):
+            value = int(value) if value else None
+        elif field == "coverage_percent":
+            value = float(value) if value else None
+        elif field == "child_pids":
+            value = [int(pid) for pid in value.split(";") if pid]
+        record[field] = value
+    return record
+
+
+def iter_result_records(file_name):
+    with open(file_name, "r") as result_file:
+        if file_name.endswith(".csv"):
+            reader = csv.DictReader(result_file)
+            for row in reader:
+                # measure.sh appends one header per run.
+                if row.get("run") == "run":
+                    continue
+                try:
+                    record = _parse_csv_row(row)
+                except ValueError as err:
+                    raise ValueError("%s:%d: %s" % (file_name, reader.line_num, err))
+                yield validate_result_record(record, file_name, reader.line_num)
+            return
+        for line_number, line in enumerate(result_file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as err:
+                raise ValueError("%s:%d: %s" % (file_name, line_number, err))
+            yield validate_result_record(record, file_name, line_number)
+
+
+def read_memories(file_name):
+    memories = []
+    amount_of_errors = 0
+    if file_name.endswith(STRUCTURED_RESULT_EXTENSIONS):
+        for record in iter_result_records(file_name):
+            if record.get("error"):
+                amount_of_errors += 1
+                continue
+            memories.append(round(float(record["peak_B"]) / TO_MEGA, 2))
+        return memories, amount_of_errors
+
+    measure = open(file_name, "r")
+    for line in measure:
+        if re.match(".*Error.*", line):
+            amount_of_errors += 1
+            continue
+        split_line = line.split()
+        if len(split_line) is 0:
+            continue
+        memories.append(float(split_line[2]))
+    measure.close()
+    return memories, amount_of_errors
 
-def plot_bars(data_bars, measured_site, prefix):
-    plotly.offline.plot({
+
+def get_bars_figure(data_bars, measured_site):
+    return {
         "data": data_bars,
-        "layout": Layout(title=measured_site,
-                         xaxis=dict(title="Version"),
-                         yaxis=dict(title="Memory consumption (MiB)"),
-                         barmode="group",
-                         )
-    },
-        filename=prefix + measured_site + "-bars.html",
-        image="jpeg",
-        image_filename=prefix + measured_site + "-bars"
-    )
-
-
-def plot_lines(data_lines, measured_site):
-    plotly.offline.plot({
+        "layout": dict(title=measured_site,
+                       xaxis=dict(title="Version"),
+                       yaxis=dict(title="Memory consumption (MiB)"),
+                       barmode="group",
+                       )
+    }
+
+
+def get_lines_figure(data_lines, measured_site):
+    return {
         "data": data_lines,
-        "layout": Layout(title=measured_site,
-                         xaxis=dict(title="Version"),
-                         yaxis=dict(title="Memory consumption (MiB)"),
-                         )
-    },
-        filename=measured_site + "-lines.html",
-        image="jpeg",
-        image_filename=measured_site + "-lines"
-    )
-
-
-def plot_box(data_box, measured_site, table_rows):
+        "layout": dict(title=measured_site,
+                       xaxis=dict(title="Version"),
+                       yaxis=dict(title="Memory consumption (MiB)"),
+                       )
+    }
+
+
+def get_box_figure(data_box, measured_site, table_rows):
+    from plotly.graph_objs import Data
+    from plotly.figure_factory import create_table
     figure = create_table(table_rows)
 
     figure['data'].extend(Data(data_box))
@@ -103,11 +448,15 @@ def plot_box(data_box, measured_site, table_rows):
     figure.layout.margin.update({'t': 75, 'l': 50})
     figure.layout.update({'title': measured_site})
     figure.layout.update({'height': 800})
+    return figure
+
 
+def plot_figure(figure, file_name):
+    import plotly.offline
     plotly.offline.plot(figure,
-                        filename=measured_site + "-box-plot.html",
+                        filename=file_name + ".html",
                         image="jpeg",
-                        image_filename=measured_site + "-box-plot"
+                        image_filename=file_name
                         )
 
 
@@ -142,10 +491,11 @@ def append_bars_and_lines(data1, data2, data3, measure_results, table_rows):
             for memory in memories:
                 one_table_row.append(memory)
             table_rows.append(one_table_row)
-            data3.append(Box(y=memories,
-                             name=full_name,
-                             xaxis='x2',
-                             yaxis='y2'))
+            data3.append(dict(type="box",
+                              y=memories,
+                              name=full_name,
+                              xaxis='x2',
+                              yaxis='y2'))
         else:
             if result.is_webengine():
                 if result.get_gpu() not in webengine_compare:
@@ -166,120 +516,669 @@ def append_bars_and_lines(data1, data2, data3, measure_results, table_rows):
                     values_to_append.append(inner_value)
             else:
                 values_to_append = values
-            data2.append(Scatter(x=versions,
-                                 y=values_to_append,
-                                 mode='lines+markers+text',
-                                 name=key,
-                                 text=values_to_append,
-                                 textposition='top'))
-            data1.append(Bar(x=versions,
-                             y=values_to_append,
-                             name=key,
-                             text=values_to_append,
-                             textposition='auto'))
+            data2.append(dict(type="scatter",
+                              x=versions,
+                              y=values_to_append,
+                              mode='lines+markers+text',
+                              name=key,
+                              text=values_to_append,
+                              textposition='top'))
+            data1.append(dict(type="bar",
+                              x=versions,
+                              y=values_to_append,
+                              name=key,
+                              text=values_to_append,
+                              textposition='auto'))
     else:
         for key, values in webengine_compare.items():
             values_to_append = []
             for inner_key, inner_value in sorted(values.items()):
                 values_to_append.append(inner_value)
-            data1.append(Bar(x=versions,
-                             y=values_to_append,
-                             name=key,
-                             text=values_to_append,
-                             textposition='auto'))
+            data1.append(dict(type="bar",
+                              x=versions,
+                              y=values_to_append,
+                              name=key,
+                              text=values_to_append,
+                              textposition='auto'))
         for key, values in sorted(webkit_compare.items()):
             values_to_append = []
             for inner_key, inner_value in sorted(values.items()):
                 webkit_labels.append(inner_key)
                 values_to_append.append(inner_value)
-            data2.append(Bar(x=webkit_labels,
-                             y=values_to_append,
-                             name=key,
-                             text=values_to_append,
-                             textposition='auto'))
+            data2.append(dict(type="bar",
+                              x=webkit_labels,
+                              y=values_to_append,
+                              name=key,
+                              text=values_to_append,
+                              textposition='auto'))
+
+
+def build_measure_result(gpu, engine, version, memories):
+    memory_values = list(memories)
+    if len(memory_values) > 2:
+        memory_values.remove(max(memory_values))
+        memory_values.remove(min(memory_values))
+    mem_len = len(memory_values)
+    average_memory = float(format((sum(memory_values) / mem_len), '.3f'))
+    return MeasureResult(gpu, engine, version, average_memory, memory_values)
+
+
+def get_site_data(results):
+    # The traces of the bars, the lines (or WebKit bars) and the box plot, and the run table of one site.
+    data_lines_or_bars = []
+    data_bars = []
+    data_box = []
+    table_rows = [["Version", "Run1", "Run2", "Run3", "Run4", "Run5", "Run6", "Run7", "Run8"]]
+
+    measure_results = []
+    for root, gpu, engine, version, amount_of_errors, memories in results:
+        measure_results.append(build_measure_result(gpu, engine, version, memories))
+
+    append_bars_and_lines(data_bars, data_lines_or_bars, data_box, measure_results, table_rows)
+    return measure_results[0].is_compare(), data_bars, data_lines_or_bars, data_box, table_rows
+
+
+def get_site_figures(measured_site, results):
+    # The figures of one site as (file name, figure) pairs.
+    is_compare, data_bars, data_lines_or_bars, data_box, table_rows = get_site_data(results)
+    if is_compare:
+        return [("WE-" + measured_site + "-bars", get_bars_figure(data_bars, measured_site)),
+                ("WK-" + measured_site + "-bars", get_bars_figure(data_lines_or_bars, measured_site))]
+    return [(measured_site + "-bars", get_bars_figure(data_bars, measured_site)),
+            (measured_site + "-lines", get_lines_figure(data_lines_or_bars, measured_site)),
+            (measured_site + "-box-plot", get_box_figure(data_box, measured_site, table_rows))]
+
+
+def _format_svg_number(value):
+    if isinstance(value, float):
+        return ("%.3f" % value).rstrip("0").rstrip(".")
+    return escape(str(value))
+
+
+def get_svg_ticks(minimum, maximum, count=5):
+    # Round tick values covering minimum..maximum, 1, 2 or 5 times a power of ten apart.
+    if maximum <= minimum:
+        maximum = minimum + 1
+    raw_step = (maximum - minimum) / float(count)
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(factor * magnitude for factor in (1, 2, 5, 10) if factor * magnitude >= raw_step)
+    first = math.floor(minimum / step) * step
+    ticks = []
+    tick = first
+    while tick < maximum + step:
+        ticks.append(tick)
+        tick += step
+    return ticks
+
+
+class SvgPlot(object):
+    # One plot area with a title, a categorical x axis, a linear y axis and a legend.
+    def __init__(self, title, categories, minimum, maximum, top=0):
+        self.left, plot_top, self.right_margin, self.bottom_margin = SVG_MARGINS
+        self.top = top + plot_top
+        self.bottom = top + SVG_HEIGHT - self.bottom_margin
+        self.right = SVG_WIDTH - self.right_margin
+        self.categories = categories
+        self.ticks = get_svg_ticks(minimum, maximum)
+        self.elements = ['<text x="%d" y="%d" font-size="17" text-anchor="middle">%s</text>'
+                         % (SVG_WIDTH // 2, top + 30, escape(title))]
+        self.legend_entries = 0
+
+    def get_y(self, value):
+        low, high = self.ticks[0], self.ticks[-1]
+        return self.bottom - (value - low) / float(high - low) * (self.bottom - self.top)
+
+    def get_category_width(self):
+        return (self.right - self.left) / float(max(len(self.categories), 1))
+
+    def get_x(self, category):
+        return self.left + (self.categories.index(category) + 0.5) * self.get_category_width()
+
+    def add_axes(self, x_title, y_title):
+        for tick in self.ticks:
+            y = self.get_y(tick)
+            self.elements.append('<line x1="%d" y1="%.1f" x2="%d" y2="%.1f" stroke="#eee"/>'
+                                 % (self.left, y, self.right, y))
+            self.elements.append('<text x="%d" y="%.1f" font-size="12" text-anchor="end">%s</text>'
+                                 % (self.left - 6, y + 4, _format_svg_number(tick)))
+        for category in self.categories:
+            self.elements.append('<text x="%.1f" y="%d" font-size="12" text-anchor="middle">%s</text>'
+                                 % (self.get_x(category), self.bottom + 18, escape(str(category))))
+        self.elements.append('<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="#444"/>'
+                             % (self.left, self.bottom, self.right, self.bottom))
+        self.elements.append('<text x="%d" y="%d" font-size="13" text-anchor="middle">%s</text>'
+                             % ((self.left + self.right) // 2, self.bottom + 42, escape(x_title)))
+        self.elements.append('<text x="%d" y="%d" font-size="13" text-anchor="middle" '
+                             'transform="rotate(-90 %d %d)">%s</text>'
+                             % (18, (self.top + self.bottom) // 2, 18, (self.top + self.bottom) // 2,
+                                escape(y_title)))
+
+    def add_legend(self, name, color):
+        y = self.top + 10 + self.legend_entries * 20
+        self.elements.append('<rect x="%d" y="%d" width="12" height="12" fill="%s"/>'
+                             % (self.right + 15, y - 10, color))
+        self.elements.append('<text x="%d" y="%d" font-size="12">%s</text>' % (self.right + 32, y, escape(name)))
+        self.legend_entries += 1
+
+
+def _get_svg_categories(traces, key="x"):
+    categories = []
+    for trace in traces:
+        for category in trace.get(key) or [trace.get("name")]:
+            if category not in categories:
+                categories.append(category)
+    return categories
+
+
+def render_svg_bars(traces, title):
+    categories = _get_svg_categories(traces)
+    values = [value for trace in traces for value in trace["y"]] or [0]
+    plot = SvgPlot(title, categories, min(min(values), 0), max(values) * 1.1)
+    group_width = plot.get_category_width() * 0.8
+    bar_width = group_width / max(len(traces), 1)
+    for index, trace in enumerate(traces):
+        color = SVG_COLORS[index % len(SVG_COLORS)]
+        plot.add_legend(trace["name"], color)
+        for category, value in zip(trace["x"], trace["y"]):
+            x = plot.get_x(category) - group_width / 2 + index * bar_width
+            y = plot.get_y(max(value, 0))
+            height = abs(plot.get_y(value) - plot.get_y(0))
+            plot.elements.append('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="%s"/>'
+                                 % (x, y, bar_width, height, color))
+            plot.elements.append('<text x="%.1f" y="%.1f" font-size="10" text-anchor="middle">%s</text>'
+                                 % (x + bar_width / 2, y - 3, _format_svg_number(value)))
+    plot.add_axes("Version", "Memory consumption (MiB)")
+    return plot.elements
+
+
+def render_svg_lines(traces, title):
+    categories = _get_svg_categories(traces)
+    values = [value for trace in traces for value in trace["y"]] or [0]
+    plot = SvgPlot(title, categories, min(min(values), 0), max(values) * 1.1)
+    for index, trace in enumerate(traces):
+        color = SVG_COLORS[index % len(SVG_COLORS)]
+        plot.add_legend(trace["name"], color)
+        points = [(plot.get_x(category), plot.get_y(value)) for category, value in zip(trace["x"], trace["y"])]
+        plot.elements.append('<polyline points="%s" fill="none" stroke="%s" stroke-width="2"/>'
+                             % (" ".join("%.1f,%.1f" % point for point in points), color))
+        for (x, y), value in zip(points, trace["y"]):
+            plot.elements.append('<circle cx="%.1f" cy="%.1f" r="4" fill="%s"/>' % (x, y, color))
+            plot.elements.append('<text x="%.1f" y="%.1f" font-size="10" text-anchor="middle">%s</text>'
+                                 % (x, y - 8, _format_svg_number(value)))
+    plot.add_axes("Version", "Memory consumption (MiB)")
+    return plot.elements
+
+
+def get_quartiles(values):
+    # First quartile, median and third quartile with linear interpolation, like plotly.
+    ordered = sorted(values)
+
+    def get_percentile(fraction):
+        position = (len(ordered) - 1) * fraction
+        lower = int(math.floor(position))
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+    return get_percentile(0.25), get_percentile(0.5), get_percentile(0.75)
+
+
+def render_svg_box(traces, title, top=0):
+    traces = [trace for trace in traces if trace["y"]]
+    categories = [trace["name"] for trace in traces]
+    values = [value for trace in traces for value in trace["y"]] or [0]
+    spread = (max(values) - min(values)) or 1
+    plot = SvgPlot(title, categories, min(values) - spread * 0.1, max(values) + spread * 0.1, top)
+    box_width = plot.get_category_width() * 0.5
+    for index, trace in enumerate(traces):
+        color = SVG_COLORS[index % len(SVG_COLORS)]
+        first, median, third = get_quartiles(trace["y"])
+        # The whiskers end at the furthest runs within 1.5 interquartile ranges.
+        inside = [value for value in trace["y"]
+                  if first - 1.5 * (third - first) <= value <= third + 1.5 * (third - first)]
+        x = plot.get_x(trace["name"])
+        plot.elements.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="%s"/>'
+                             % (x, plot.get_y(min(inside)), x, plot.get_y(max(inside)), color))
+        plot.elements.append('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="%s" fill-opacity="0.5" '
+                             'stroke="%s"/>' % (x - box_width / 2, plot.get_y(third), box_width,
+                                                plot.get_y(first) - plot.get_y(third), color, color))
+        plot.elements.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="%s" stroke-width="2"/>'
+                             % (x - box_width / 2, plot.get_y(median), x + box_width / 2, plot.get_y(median),
+                                color))
+        for value in trace["y"]:
+            if value not in inside:
+                plot.elements.append('<circle cx="%.1f" cy="%.1f" r="3" fill="none" stroke="%s"/>'
+                                     % (x, plot.get_y(value), color))
+        plot.add_legend(trace["name"], color)
+    plot.add_axes("Version", "Memory consumption (MiB)")
+    return plot.elements
+
+
+def render_svg_table(rows, top=0):
+    elements = []
+    column_width = (SVG_WIDTH - 20) / float(max(len(row) for row in rows))
+    for row_index, row in enumerate(rows):
+        y = top + 10 + row_index * SVG_TABLE_ROW_HEIGHT
+        fill = "#25385b" if row_index == 0 else ("#f2f2f2" if row_index % 2 else "#ffffff")
+        elements.append('<rect x="10" y="%d" width="%d" height="%d" fill="%s"/>'
+                        % (y, SVG_WIDTH - 20, SVG_TABLE_ROW_HEIGHT, fill))
+        for column_index, cell in enumerate(row):
+            elements.append('<text x="%.1f" y="%d" font-size="12"%s>%s</text>'
+                            % (16 + column_index * column_width, y + 15,
+                               ' fill="white" font-weight="bold"' if row_index == 0 else "",
+                               _format_svg_number(cell)))
+    return elements
+
+
+def get_svg_document(elements, height=SVG_HEIGHT):
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif">\n'
+            '<rect width="100%%" height="100%%" fill="white"/>\n%s\n</svg>\n'
+            % (SVG_WIDTH, height, "\n".join(elements)))
+
+
+def get_site_svgs(measured_site, results):
+    # The figures of one site as (file name, SVG document) pairs, the same ones as get_site_figures.
+    is_compare, data_bars, data_lines_or_bars, data_box, table_rows = get_site_data(results)
+    if is_compare:
+        return [("WE-" + measured_site + "-bars", get_svg_document(render_svg_bars(data_bars, measured_site))),
+                ("WK-" + measured_site + "-bars",
+                 get_svg_document(render_svg_bars(data_lines_or_bars, measured_site)))]
+    table_height = len(table_rows) * SVG_TABLE_ROW_HEIGHT + 20
+    box_plot = render_svg_table(table_rows) + render_svg_box(data_box, measured_site, table_height)
+    return [(measured_site + "-bars", get_svg_document(render_svg_bars(data_bars, measured_site))),
+            (measured_site + "-lines", get_svg_document(render_svg_lines(data_lines_or_bars, measured_site))),
+            (measured_site + "-box-plot", get_svg_document(box_plot, table_height + SVG_HEIGHT))]
+
+
+def write_svg(document, file_name, png):
+    with open(file_name + ".svg", "w") as svg_file:
+        svg_file.write(document)
+    if png:
+        try:
+            import cairosvg
+        except ImportError:
+            raise RuntimeError("The PNG output needs cairosvg!")
+        cairosvg.svg2png(bytestring=document.encode("utf-8"), write_to=file_name + ".png")
+
+
+def render_site(job):
+    # Returns the site and the files written for it, relative to the output directory.
+    measured_site, results, output_dir, backend, png = job
+    if backend == "svg":
+        outputs = []
+        for file_name, document in get_site_svgs(measured_site, results):
+            write_svg(document, os.path.join(output_dir or ".", file_name), png)
+            outputs.append(file_name + ".svg")
+            if png:
+                outputs.append(file_name + ".png")
+        return measured_site, outputs
+    figures = get_site_figures(measured_site, results)
+    if output_dir is None:
+        for file_name, figure in figures:
+            plot_figure(figure, file_name)
+        return measured_site, [file_name + ".html" for file_name, figure in figures]
+    # Only the data and the layout of the figures, plotly.js is shared by the whole dashboard.
+    import plotly.utils
+    figures_json = json.dumps([{"data": figure["data"], "layout": figure["layout"]} for file_name, figure in figures],
+                              cls=plotly.utils.PlotlyJSONEncoder)
+    data_file_name = os.path.join("data", measured_site + ".js")
+    with open(os.path.join(output_dir, data_file_name), "w") as data_file:
+        data_file.write("loadSiteFigures(%s, %s);\n" % (json.dumps(measured_site), figures_json))
+    return measured_site, [data_file_name]
+
+
+def write_dashboard(output_dir, sites, write_plotly_js=True):
+    if write_plotly_js:
+        import plotly.offline.offline
+        with open(os.path.join(output_dir, PLOTLY_JS_NAME), "w") as plotly_js:
+            plotly_js.write(plotly.offline.offline.get_plotlyjs())
+    with open(os.path.join(output_dir, "index.html"), "w") as index:
+        index.write(DASHBOARD_TEMPLATE % {"plotly_js": PLOTLY_JS_NAME, "sites": json.dumps(sites)})
+
+
+def write_svg_index(output_dir, site_outputs):
+    sections = []
+    for measured_site, outputs in sorted(site_outputs.items()):
+        images = "".join('<img src="%s" loading="lazy">\n' % escape(output, {'"': "&quot;"})
+                         for output in outputs if output.endswith(".svg"))
+        sections.append("<h2>%s</h2>\n%s" % (escape(measured_site), images))
+    with open(os.path.join(output_dir, "index.html"), "w") as index:
+        index.write(SVG_INDEX_TEMPLATE % {"sites": "".join(sections)})
+
+
+def get_backend_version(backend):
+    if backend == "svg":
+        return None
+    import plotly
+    return plotly.__version__
+
+
+def get_figures_hash(measured_site, results, standalone, backend="plotly", png=False):
+    # Hash of everything the figures of a site are rendered from.
+    inputs = [FIGURES_VERSION, get_backend_version(backend), backend, png, standalone, measured_site, results]
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ChartsManifest(object):
+    def __init__(self, directory):
+        self.file_name = os.path.join(directory, MANIFEST_NAME)
+        self.directory = directory
+        self.sites = {}
+        self.plotly_version = None
+        try:
+            with open(self.file_name, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get("figures_version") == FIGURES_VERSION:
+                self.sites = manifest["sites"]
+                self.plotly_version = manifest.get("plotly_version")
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def is_up_to_date(self, measured_site, figures_hash):
+        entry = self.sites.get(measured_site)
+        return entry is not None and entry["hash"] == figures_hash and \
+            all(os.path.exists(os.path.join(self.directory, output)) for output in entry["outputs"])
+
+    def update(self, measured_site, figures_hash, outputs):
+        # Returns the outputs of the previous rendering that were not written again.
+        old_outputs = self.sites.get(measured_site, {}).get("outputs", [])
+        self.sites[measured_site] = {"hash": figures_hash, "outputs": outputs}
+        return [output for output in old_outputs if output not in outputs]
+
+    def remove(self, measured_site):
+        return self.sites.pop(measured_site)["outputs"]
+
+    def save(self):
+        temporary_name = "%s.%d.tmp" % (self.file_name, os.getpid())
+        with open(temporary_name, "w") as manifest_file:
+            json.dump({"figures_version": FIGURES_VERSION, "plotly_version": self.plotly_version,
+                       "sites": self.sites}, manifest_file, indent=1, sort_keys=True)
+        os.rename(temporary_name, self.file_name)
+
+
+def render_sites(site_results, jobs, output_dir, force=False, keep_other_sites=False, backend="plotly", png=False):
+    # Renders the sites whose results changed since the last run into output_dir,
+    # or standalone into the current directory, and removes the stale outputs.
+    if output_dir is not None:
+        data_dir = os.path.join(output_dir, "data") if backend == "plotly" else output_dir
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+    directory = output_dir if output_dir is not None else "."
+    manifest = ChartsManifest(directory)
+    hashes = dict((measured_site, get_figures_hash(measured_site, results, output_dir is None, backend, png))
+                  for measured_site, results in site_results)
+    render_jobs = [(measured_site, results, output_dir, backend, png) for measured_site, results in site_results
+                   if force or not manifest.is_up_to_date(measured_site, hashes[measured_site])]
+
+    pool = None
+    if jobs > 1 and len(render_jobs) > 1:
+        pool = multiprocessing.Pool(jobs)
+        rendered_sites = list(pool.imap_unordered(render_site, render_jobs))
+        pool.close()
+        pool.join()
+    else:
+        rendered_sites = [render_site(job) for job in render_jobs]
+
+    stale_outputs = []
+    for measured_site, outputs in rendered_sites:
+        stale_outputs.extend(manifest.update(measured_site, hashes[measured_site], outputs))
+    if not keep_other_sites:
+        for measured_site in set(manifest.sites) - set(hashes):
+            stale_outputs.extend(manifest.remove(measured_site))
+    for output in stale_outputs:
+        try:
+            os.remove(os.path.join(directory, output))
+        except OSError:
+            pass
+
+    if output_dir is not None and backend == "svg":
+        write_svg_index(output_dir, dict((measured_site, entry["outputs"])
+                                         for measured_site, entry in manifest.sites.items()))
+    elif output_dir is not None:
+        plotly_version = get_backend_version(backend)
+        write_plotly_js = force or manifest.plotly_version != plotly_version or \
+            not os.path.exists(os.path.join(output_dir, PLOTLY_JS_NAME))
+        write_dashboard(output_dir, sorted(manifest.sites), write_plotly_js)
+        manifest.plotly_version = plotly_version
+    manifest.save()
+    sys.stderr.write("Rendered %d of %d sites, removed %d stale outputs\n"
+                     % (len(rendered_sites), len(site_results), len(stale_outputs)))
+
+
+def get_version_key(version):
+    # "5.10" comes after "5.9".
+    return tuple(int(part) if part.isdigit() else part for part in re.split("[.-]", version or ""))
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("The regression report needs numpy!")
+    return numpy
+
+
+def bootstrap_mean_intervals(memory_sets, resamples, confidence, seed):
+    # Mean and bootstrap confidence interval of the mean of every memory set. The
+    # sets with the same number of runs share their resampling indices.
+    numpy = _import_numpy()
+    generator = numpy.random.RandomState(seed)
+    intervals = [None] * len(memory_sets)
+    positions_per_runs = {}
+    for position, memories in enumerate(memory_sets):
+        if len(memories):
+            positions_per_runs.setdefault(len(memories), []).append(position)
+    tail = (100.0 - confidence) / 2
+    for runs, positions in sorted(positions_per_runs.items()):
+        indexes = generator.randint(0, runs, (resamples, runs))
+        for block_start in range(0, len(positions), BOOTSTRAP_BLOCK):
+            block = positions[block_start:block_start + BOOTSTRAP_BLOCK]
+            matrix = numpy.array([memory_sets[position] for position in block], dtype="float64")
+            means = matrix[:, indexes].mean(axis=2)
+            lows, highs = numpy.percentile(means, [tail, 100.0 - tail], axis=1)
+            for row, position in enumerate(block):
+                intervals[position] = (float(matrix[row].mean()), float(lows[row]), float(highs[row]))
+    return intervals
+
+
+def mann_whitney_u(baseline, candidate):
+    # U statistic of the candidate and the two-sided p-value of the normal
+    # approximation with tie and continuity correction.
+    numpy = _import_numpy()
+    combined = numpy.concatenate([numpy.asarray(baseline, dtype="float64"),
+                                  numpy.asarray(candidate, dtype="float64")])
+    values, inverse, counts = numpy.unique(combined, return_inverse=True, return_counts=True)
+    average_ranks = numpy.cumsum(counts) - (counts - 1) / 2.0
+    ranks = average_ranks[inverse]
+    baseline_runs = len(baseline)
+    candidate_runs = len(candidate)
+    runs = baseline_runs + candidate_runs
+    u = float(ranks[baseline_runs:].sum()) - candidate_runs * (candidate_runs + 1) / 2.0
+    mean_u = baseline_runs * candidate_runs / 2.0
+    ties = float((counts ** 3 - counts).sum())
+    variance = baseline_runs * candidate_runs / 12.0 * ((runs + 1) - ties / (runs * (runs - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = max(abs(u - mean_u) - 0.5, 0) / math.sqrt(variance)
+    return u, math.erfc(z / math.sqrt(2))
+
+
+def get_comparison_pairs(results):
+    # Consecutive versions of the same engine on the same GPU, and consecutive
+    # GPUs with the same engine version, as pairs of positions in results.
+    versions = {}
+    gpus = {}
+    for position, (root, gpu, engine, version, errors, memories) in enumerate(results):
+        if version is not None:
+            versions.setdefault((gpu, engine), []).append(position)
+        if gpu is not None:
+            gpus.setdefault((engine, version), []).append(position)
+    pairs = []
+    for key, positions in sorted(versions.items()):
+        positions.sort(key=lambda position: get_version_key(results[position][3]))
+        pairs.extend(("version", baseline, candidate) for baseline, candidate in zip(positions, positions[1:]))
+    for key, positions in sorted(gpus.items()):
+        positions.sort(key=lambda position: results[position][1])
+        pairs.extend(("gpu", baseline, candidate) for baseline, candidate in zip(positions, positions[1:]))
+    return pairs
+
+
+def _describe_result(result, interval):
+    root, gpu, engine, version, errors, memories = result
+    description = collections.OrderedDict()
+    description["root"] = root
+    description["gpu"] = gpu
+    description["engine"] = engine
+    description["version"] = version
+    description["runs"] = len(memories)
+    description["errors"] = errors
+    description["mean_MiB"] = round(interval[0], 3)
+    description["ci_MiB"] = [round(interval[1], 3), round(interval[2], 3)]
+    return description
+
+
+def build_regression_report(site_results, threshold, alpha, resamples, confidence, seed):
+    memory_sets = []
+    for measured_site, results in site_results:
+        memory_sets.extend(result[5] for result in results)
+    intervals = bootstrap_mean_intervals(memory_sets, resamples, confidence, seed)
+
+    comparisons = []
+    first_position = 0
+    for measured_site, results in site_results:
+        for kind, baseline, candidate in get_comparison_pairs(results):
+            baseline_interval = intervals[first_position + baseline]
+            candidate_interval = intervals[first_position + candidate]
+            if baseline_interval is None or candidate_interval is None:
+                continue
+            u, p_value = mann_whitney_u(results[baseline][5], results[candidate][5])
+            change = float("inf")
+            if baseline_interval[0]:
+                change = (candidate_interval[0] - baseline_interval[0]) / baseline_interval[0] * 100
+            comparison = collections.OrderedDict()
+            comparison["site"] = measured_site
+            comparison["kind"] = kind
+            comparison["baseline"] = _describe_result(results[baseline], baseline_interval)
+            comparison["candidate"] = _describe_result(results[candidate], candidate_interval)
+            comparison["change_percent"] = round(change, 3)
+            comparison["u"] = u
+            comparison["p_value"] = p_value
+            comparison["regression"] = change > threshold and p_value < alpha
+            comparisons.append(comparison)
+        first_position += len(results)
+
+    report = collections.OrderedDict()
+    report["threshold_percent"] = threshold
+    report["alpha"] = alpha
+    report["confidence_percent"] = confidence
+    report["bootstrap_resamples"] = resamples
+    report["regressions"] = sum(1 for comparison in comparisons if comparison["regression"])
+    report["comparisons"] = comparisons
+    return report
+
+
+def write_regression_report(report, file_name):
+    if file_name == "-":
+        json.dump(report, sys.stdout, indent=2, separators=(",", ": "))
+        sys.stdout.write("\n")
+        return
+    with open(file_name, "w") as report_file:
+        json.dump(report, report_file, indent=2, separators=(",", ": "))
+        report_file.write("\n")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Charts the memory consumption of the measured sites "
+                                                 "across Qt versions and GPUs.")
+    parser.add_argument("dir_name", help="results tree with one directory per engine version")
+    parser.add_argument("--db", help="results database (default: <dir_name>/%s)" % DEFAULT_DATABASE_NAME)
+    parser.add_argument("--site", help="only chart this site")
+    parser.add_argument("--engine", help="only use the results of this engine, e.g. QtWebEngine")
+    parser.add_argument("--version", help="only use the results of this engine version")
+    parser.add_argument("--gpu", help="only use the results measured on this GPU, e.g. Intel")
+    parser.add_argument("--query", action="store_true",
+                        help="print the matching results instead of charting them")
+    parser.add_argument("--report", metavar="FILE",
+                        help="write the bootstrap confidence intervals and the Mann-Whitney U tests between "
+                             "consecutive versions and GPUs of every site as JSON into FILE (- for stdout)")
+    parser.add_argument("--threshold", type=float, default=5.0, metavar="PERCENT",
+                        help="a significant increase of the mean above this is a regression (default: %(default)s)")
+    parser.add_argument("--alpha", type=float, default=0.05,
+                        help="significance level of the U tests (default: %(default)s)")
+    parser.add_argument("--confidence", type=float, default=95.0, metavar="PERCENT",
+                        help="confidence level of the intervals (default: %(default)s)")
+    parser.add_argument("--bootstrap", type=int, default=2000, metavar="RESAMPLES",
+                        help="bootstrap resamples per result (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap (default: %(default)s)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with %d if the report contains a regression" % REGRESSION_EXIT_CODE)
+    parser.add_argument("--no-charts", action="store_true", help="only write the report")
+    parser.add_argument("--backend", choices=BACKENDS, default="plotly",
+                        help="plotly: interactive dashboard (or HTML files with --standalone), svg: static SVG "
+                             "figures and an index.html without plotly or a browser (default: %(default)s)")
+    parser.add_argument("--png", action="store_true", help="also write PNG images with the svg backend (needs cairosvg)")
+    parser.add_argument("--force", action="store_true",
+                        help="render every site again, even if its results did not change since the last run")
+    parser.add_argument("-o", "--output-dir", default=DEFAULT_DASHBOARD_DIR,
+                        help="directory of the dashboard (default: %(default)s)")
+    parser.add_argument("--standalone", action="store_true",
+                        help="write one standalone HTML file per figure instead of the dashboard")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of figures rendered at the same time (default: %(default)s)")
+    return parser.parse_args()
+
+
+def print_results(database, sites, filters):
+    for site in sites:
+        for root, gpu, engine, version, errors, memories in database.get_results(site, filters):
+            average = sum(memories) / len(memories) if memories else float("nan")
+            print("%s\t%s\t%s\t%s\t%s\truns=%d\terrors=%d\taverage=%.3f"
+                  % (site, root, gpu, engine, version, len(memories), errors, average))
 
 
 def main():
-    dir_name = sys.argv[1]
-    files_per_version = get_benchmark_list(dir_name)
+    arguments = parse_arguments()
+    dir_name = arguments.dir_name
+    database = ResultsDatabase(arguments.db or os.path.join(dir_name, DEFAULT_DATABASE_NAME))
+    filters = {"engine": arguments.engine, "version": arguments.version, "gpu": arguments.gpu}
+    try:
+        database.ingest(dir_name, filters, arguments.site)
+    except ValueError as err:
+        sys.stderr.write("Invalid result file: %s\n" % str(err))
+        exit(1)
 
-    first_root = files_per_version.keys()[0]
-    first_files = files_per_version.get(first_root)
+    roots = database.get_roots(filters)
+    sites = database.get_sites(filters)
+    if arguments.site is not None:
+        sites = [site for site in sites if site == arguments.site]
+    if arguments.query:
+        print_results(database, sites, filters)
+        database.close()
+        return
 
-    for file_name in first_files:
-        if not is_measured_with_every_version(file_name, files_per_version.values()):
-            continue
+    all_site_results = [(measured_site, database.get_results(measured_site, filters)) for measured_site in sites]
+    database.close()
 
-        data_lines_or_bars = []
-        data_bars = []
-        data_box = []
-        table_rows = [["Version", "Run1", "Run2", "Run3", "Run4", "Run5", "Run6", "Run7", "Run8"]]
-
-        measure_results = []
-        measured_site = None
-
-        for root in sorted(files_per_version.keys()):
-            amount_of_errors = 0
-            file_to_open = os.path.join(root, file_name)
-            gpu = None
-            measure = open(file_to_open, "r")
-            split_name = file_to_open.split("/")
-            engine = None
-            site = None
-            version = None
-            for part in split_name:
-                if re.match(".*QtWebkit.*", part):
-                    name_and_version = part.split("-")
-                    if name_and_version[0] == "Intel" or name_and_version[0] == "Nvidia":
-                        gpu = name_and_version[0]
-                        engine = name_and_version[1]
-                        if len(name_and_version) is 3:
-                            engine += "-" + name_and_version[2]
-                    else:
-                        engine = part
-                if re.match(".*QtWebEngine.*", part):
-                    name_and_version = part.split("-")
-                    if name_and_version[0] == "Intel" or name_and_version[0] == "Nvidia":
-                        gpu = name_and_version[0]
-                        engine = name_and_version[1]
-                        version = name_and_version[2]
-                    else:
-                        engine = name_and_version[0]
-                        version = name_and_version[1]
-                if re.match(".*\.txt", part):
-                    site = part.split(".")[0]
-            memories = []
-            if measured_site is None:
-                measured_site = site
-            if not measured_site == site:
-                sys.stderr.write("Error\n")
+    report = None
+    if arguments.report:
+        report = build_regression_report(all_site_results, arguments.threshold, arguments.alpha,
+                                          arguments.bootstrap, arguments.confidence, arguments.seed)
+        write_regression_report(report, arguments.report)
+
+    if not arguments.no_charts:
+        if arguments.png and arguments.backend == "svg":
+            try:
+                import cairosvg
+            except ImportError:
+                sys.stderr.write("The PNG output needs cairosvg!\n")
                 exit(1)
-            for line in measure:
-                if re.match(".*Error.*", line):
-                    amount_of_errors += 1
-                    continue
-                split_line = line.split()
-                if len(split_line) is 0:
-                    continue
-                memories.append(float(split_line[2]))
-            memory_values = memories
-            if len(memory_values) > 2:
-                memory_values.remove(max(memory_values))
-                memory_values.remove(min(memory_values))
-            mem_len = len(memory_values)
-            average_memory = float(format((sum(memory_values) / mem_len), '.3f'))
-            measure_results.append(MeasureResult(gpu, engine, version, average_memory, memory_values))
-            measure.close()
-
-        is_compare = measure_results[0].is_compare()
-        append_bars_and_lines(data_bars, data_lines_or_bars, data_box, measure_results, table_rows)
-        if is_compare:
-            plot_bars(data_bars, measured_site, "WE-")
-            plot_bars(data_lines_or_bars, measured_site, "WK-")
-        else:
-            plot_bars(data_bars, measured_site, None)
-            plot_lines(data_lines_or_bars, measured_site)
-            plot_box(data_box, measured_site, table_rows)
+        # Only the sites measured with every version are charted.
+        site_results = [(measured_site, results) for measured_site, results in all_site_results
+                        if len(results) == len(roots)]
+        render_sites(site_results, arguments.jobs, None if arguments.standalone else arguments.output_dir,
+                     arguments.force, arguments.site is not None, arguments.backend, arguments.png)
+
+    if report is not None and report["regressions"] and arguments.fail_on_regression:
+        sys.stderr.write("%d memory regressions above %.1f%%\n" % (report["regressions"], arguments.threshold))
+        exit(REGRESSION_EXIT_CODE)
 
 
 if __name__ == "__main__":
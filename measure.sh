@@ -1,5 +1,129 @@
 #!/bin/bash
 
+VALGRIND=${VALGRIND:-~/Work/Freya/inst/bin/valgrind}
+PARSE_LOGS=${PARSE_LOGS:-~/Work/Qt/MemoryScript/parse-logs.py}
+SAMPLE_PROC=${SAMPLE_PROC:-~/Work/Qt/MemoryScript/sample-proc.py}
+BACKEND=massif
+INTERVAL=0.05
+METRIC=pss
+COMPRESS=""
+ARCHIVE=""
+JOBS=1
+CPUS=""
+TIMEOUT=0
+RETRIES=2
+RUNS=10
+FORMAT=text
+TOLERANCE=""
+MIN_RUNS=3
+
+function usage {
+	echo "Usage: $0 [-j jobs] [-c cpu,cpu,...] [-t timeout] [-r retries] [-n runs] [-f format] [-a tolerance] [-m min-runs]"
+	echo "          [-b backend] [-i interval] [-M metric] [-z compressor] [-T] site|directory..."
+	echo "  -j  number of measurements running at the same time (default: $JOBS)"
+	echo "  -c  pin every running measurement to one CPU of this list"
+	echo "  -t  kill a measurement after this many seconds (default: no limit)"
+	echo "  -r  repeat a failed measurement this many times (default: $RETRIES)"
+	echo "  -n  number of measurements per site (default: $RUNS)"
+	echo "  -f  text, json or csv results in \$SITE.txt, \$SITE.jsonl or \$SITE.csv (default: $FORMAT)"
+	echo "  -a  adaptive mode: stop measuring a site once the 95% confidence interval of its mean peak"
+	echo "      is within this percent of the mean, -n is then the maximum number of runs"
+	echo "  -m  successful runs of a site before the adaptive mode may stop (default: $MIN_RUNS)"
+	echo "  -b  massif, or proc to run natively and sample the process tree from /proc (default: $BACKEND)"
+	echo "  -i  seconds between two samples of the proc backend (default: $INTERVAL)"
+	echo "  -M  rss, pss or anon memory measured by the proc backend (default: $METRIC)"
+	echo "  -z  compress the output files of every run with gzip, xz or zstd once they are analysed"
+	echo "  -T  move the output files of every site into \$SITE.tar at the end, parse-logs.py reads them from there"
+}
+
+function result_file {
+	case $FORMAT in
+		json) echo "$1.jsonl" ;;
+		csv) echo "$1.csv" ;;
+		*) echo "$1.txt" ;;
+	esac
+}
+
+function error_result {
+	MESSAGE="Error occurred in measure number: $1 Error code: $2"
+	case $FORMAT in
+		json) echo "{\"run\": $1, \"error\": \"$MESSAGE\"}" ;;
+		csv) echo "run,peak_B,peak_extra_B,coverage_percent,parent_pid,child_pids,processes,error"
+		     echo "$1,,,,,,,\"$MESSAGE\"" ;;
+		*) echo "Error occurred in measure number: " $1 "Error code: " $2 ;;
+	esac
+}
+
+# Appends the results of the finished runs of a site to its result file in run
+# order, the runs after an unfinished one wait for it. The jobs call it under a
+# lock, $SITE/.appended holds the number of the last appended run.
+function append_results {
+	SITE=$1
+	(
+		flock 9
+		APPENDED=$(cat "$SITE/.appended")
+		while [ -f "$SITE/$((APPENDED + 1)).result" ]; do
+			APPENDED=$((APPENDED + 1))
+			cat "$SITE/$APPENDED.result" >> "$(result_file $SITE)"
+		done
+		echo $APPENDED > "$SITE/.appended"
+	) 9> "$SITE/.append.lock"
+}
+
+function compress_run {
+	case $COMPRESS in
+		zstd) zstd -q --rm "$@" ;;
+		*) $COMPRESS -q "$@" ;;
+	esac
+}
+
+function measure_run {
+	FILEPATH=$1
+	SITE=$2
+	i=$3
+	COMMAND=()
+	if [[ $TIMEOUT -gt 0 ]]; then
+		COMMAND+=(timeout "$TIMEOUT")
+	fi
+	if [[ -n $CPUS ]]; then
+		CPU_LIST=(${CPUS//,/ })
+		COMMAND+=(taskset -c "${CPU_LIST[$((MEASURE_SLOT % ${#CPU_LIST[@]}))]}")
+	fi
+
+	for ((attempt = 0; attempt <= RETRIES; attempt++)); do
+		rm -f "$SITE/$i-".out*
+		if [[ $BACKEND == proc ]]; then
+			"${COMMAND[@]}" $SAMPLE_PROC --interval "$INTERVAL" --metric "$METRIC" \
+				--out-file "$SITE/$i-.out%p" \
+				-- ./Minimal ${FILEPATH}
+		else
+			"${COMMAND[@]}" $VALGRIND --tool=massif \
+				--trace-children=yes \
+				--time-unit=ms \
+				--smc-check=all-non-file \
+				--max-snapshots=1000 \
+				--detailed-freq=1000000 \
+				--depth=1 \
+				--massif-out-file="$SITE/$i-.out%p" \
+				./Minimal ${FILEPATH}
+		fi
+		ERROR=$?
+		if [[ $ERROR -eq 0 ]]; then
+			$PARSE_LOGS --format "$FORMAT" $SITE/$i-* > "$SITE/$i.result.tmp"
+			mv "$SITE/$i.result.tmp" "$SITE/$i.result"
+			append_results "$SITE"
+			if [[ -n $COMPRESS ]]; then
+				compress_run "$SITE/$i-".out*
+			fi
+			return
+		fi
+		echo "Measure number $i of $SITE failed with error code $ERROR (attempt $((attempt + 1)))" >&2
+	done
+	error_result $i $ERROR > "$SITE/$i.result.tmp"
+	mv "$SITE/$i.result.tmp" "$SITE/$i.result"
+	append_results "$SITE"
+}
+
 function measure {
 	FILEPATH=$1
 	if [[ $FILEPATH == */index.html && $FILEPATH == */bootstrap/* ]]; then
@@ -15,31 +139,101 @@ function measure {
 		SITE=${FILEPATH#*.}
 		SITE=${SITE%%.*}
 	fi
-	
+
 	if [ ! -d "$SITE" ]; then
 		mkdir $SITE
 	fi
+	# The results left by an interrupted campaign were appended already.
+	rm -f "$SITE"/[0-9]*.result
+	echo 0 > "$SITE/.appended"
 
-	for i in {1..10}; do
-				~/Work/Freya/inst/bin/valgrind --tool=massif \
-									   		 --trace-children=yes \
-									   		 --time-unit=ms \
-											 --smc-check=all-non-file \
-											 --max-snapshots=1000 \
-										   	 --detailed-freq=1000000 \
-											 --depth=1 \
-											 --massif-out-file="$SITE/$i-.out%p" \
-											 ./Minimal ${FILEPATH}
-				if [[ $? -ne 0 ]]; then
-				    i = i - 1
-				    echo "Error occurred in measure number: " $i "Error code: " $? >> $SITE.txt
-				else
-				    ~/Work/Qt/MemoryScript/parse-logs.py $SITE/$i-* >> $SITE.txt
-				fi
+	SITES+=("$SITE")
+	SITE_PATHS[$SITE]=$FILEPATH
+	SITE_RUNS[$SITE]=0
+	if [[ -n $TOLERANCE ]]; then
+		queue_runs "$SITE" $((MIN_RUNS < RUNS ? MIN_RUNS : RUNS))
+	else
+		queue_runs "$SITE" "$RUNS"
+	fi
+}
+
+function queue_runs {
+	SITE=$1
+	for ((n = 0; n < $2; n++)); do
+		SITE_RUNS[$SITE]=$((SITE_RUNS[$SITE] + 1))
+		printf '%s\0%s\0%s\0' "${SITE_PATHS[$SITE]}" "$SITE" "${SITE_RUNS[$SITE]}" >> "$QUEUE"
+	done
+}
+
+function run_queue {
+	# Every measurement is a separate job, xargs keeps $JOBS of them running
+	# and tells each one its slot number for the CPU pinning.
+	xargs -0 -n 3 -P "$JOBS" --process-slot-var=MEASURE_SLOT \
+		bash -c 'measure_run "$@"' measure_run < "$QUEUE"
+	: > "$QUEUE"
+}
+
+# Queues more runs of every site whose results are not stable yet. The free
+# workers are shared between these sites, so a single unstable site still
+# gets $JOBS runs per round. Returns 1 when every site is finished.
+function queue_unstable_sites {
+	UNSTABLE=()
+	for SITE in "${SITES[@]}"; do
+		if [[ -n ${SITE_DONE[$SITE]} ]]; then
+			continue
+		fi
+		RESULTS=()
+		for ((i = 1; i <= SITE_RUNS[$SITE]; i++)); do
+			RESULTS+=("$SITE/$i.result")
+		done
+		DECISION=($($PARSE_LOGS --stability --format "$FORMAT" --min-runs "$MIN_RUNS" --max-runs "$RUNS" \
+			--tolerance "$TOLERANCE" "${RESULTS[@]}"))
+		if [[ ${DECISION[0]} == continue ]]; then
+			UNSTABLE+=("$SITE")
+		else
+			SITE_DONE[$SITE]=1
+			echo "$SITE: ${DECISION[1]} runs, mean peak ${DECISION[3]} B, interval +-${DECISION[4]}%" >&2
+		fi
+	done
+	if [[ ${#UNSTABLE[@]} -eq 0 ]]; then
+		return 1
+	fi
+	STEP=$(((JOBS + ${#UNSTABLE[@]} - 1) / ${#UNSTABLE[@]}))
+	for SITE in "${UNSTABLE[@]}"; do
+		REMAINING=$((RUNS - SITE_RUNS[$SITE]))
+		queue_runs "$SITE" $((STEP < REMAINING ? STEP : REMAINING))
 	done
 }
 
 
+while getopts "j:c:t:r:n:f:a:m:b:i:M:z:Th" OPTION; do
+	case $OPTION in
+		j) JOBS=$OPTARG ;;
+		c) CPUS=$OPTARG ;;
+		t) TIMEOUT=$OPTARG ;;
+		r) RETRIES=$OPTARG ;;
+		n) RUNS=$OPTARG ;;
+		f) FORMAT=$OPTARG ;;
+		a) TOLERANCE=$OPTARG ;;
+		m) MIN_RUNS=$OPTARG ;;
+		b) BACKEND=$OPTARG ;;
+		i) INTERVAL=$OPTARG ;;
+		M) METRIC=$OPTARG ;;
+		z) case $OPTARG in
+			gzip|xz|zstd) COMPRESS=$OPTARG ;;
+			*) usage; exit 1 ;;
+			esac ;;
+		T) ARCHIVE=1 ;;
+		*) usage; exit 1 ;;
+	esac
+done
+shift $((OPTIND - 1))
+
+SITES=()
+declare -A SITE_PATHS SITE_RUNS SITE_DONE
+QUEUE=$(mktemp)
+trap 'rm -f "$QUEUE"' EXIT
+
 for ARG in $*; do
 	REGEX='(https?|ftp|file)?(://)?[-A-Za-z0-9\+&@#/%?=~_|!:,.;]*[-A-Za-z0-9\+&@#/%=~_|]'
 	if [ -d "$ARG" ]; then
@@ -52,3 +246,20 @@ for ARG in $*; do
 		measure $ARG
 	fi
 done
+
+export VALGRIND PARSE_LOGS SAMPLE_PROC BACKEND INTERVAL METRIC COMPRESS CPUS TIMEOUT RETRIES FORMAT
+export -f measure_run error_result compress_run append_results result_file
+run_queue
+if [[ -n $TOLERANCE ]]; then
+	while queue_unstable_sites; do
+		run_queue
+	done
+fi
+
+for SITE in "${SITES[@]}"; do
+	# The adaptive mode reads the results of every run, they are removed at the end.
+	rm -f "$SITE"/[0-9]*.result "$SITE/.appended" "$SITE/.append.lock"
+	if [[ -n $ARCHIVE ]] && compgen -G "$SITE/[0-9]*-.out*" > /dev/null; then
+		(cd "$SITE" && tar -rf "../$SITE.tar" [0-9]*-.out* && rm -f [0-9]*-.out*)
+	fi
+done
@@ -1,177 +1,1088 @@
 #!/usr/bin/env python
 
+import os
 import re
 import sys
+import json
+import time
+import mmap
+import heapq
+import signal
+import array
+import struct
+import hashlib
+import fcntl
+import gzip
+import tarfile
+import cProfile
+import argparse
+import multiprocessing
+import bisect
 import itertools
 import collections
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 MAX_SNAPSHOT_DIFF = 1000000
 TO_KILO = 1024
 TO_MEGA = 1024*1024
+PARSE_CHUNK_SIZE = 4 * TO_MEGA
+# Has to be increased whenever the parsed result of a log file changes, it invalidates the caches.
+PARSER_VERSION = 2
+CACHE_MAGIC = b"MSFC"
+DEFAULT_CACHE_SIZE = 512 * TO_MEGA
+CACHE_INDEX_NAME = "size.index"
+# An eviction shrinks the cache to this part of its maximum size, so the next stores do not evict again.
+CACHE_EVICTION_TARGET = 0.9
+RESULT_FILE_EXTENSIONS = {"text": ".txt", "json": ".jsonl", "csv": ".csv"}
+CSV_FIELDS = ("run", "peak_B", "peak_extra_B", "coverage_percent", "parent_pid", "child_pids", "processes", "error")
+SNAPSHOT_COLUMNS = ("timestamp", "mem_heap_B", "mem_heap_extra_B", "mem_stacks_B")
+DETAILED_HEAP_TREES = ("detailed", "peak")
+BELOW_THRESHOLD_NAME = "(below threshold)"
+COMPRESSED_EXTENSIONS = (".gz", ".xz", ".zst")
+ARCHIVE_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.xz")
+TimeInterval = collections.namedtuple("TimeInterval", ["start", "end"])
+AllocationSite = collections.namedtuple("AllocationSite", ["function", "bytes", "pids"])
+AllocationDiff = collections.namedtuple("AllocationDiff", ["function", "baseline_bytes", "candidate_bytes", "change"])
+DEFAULT_DIFF_SITES = 20
+# Two-sided 95% quantiles of Student's t distribution for 1..30 degrees of freedom.
+T_QUANTILES_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                  2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                  2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+NORMAL_QUANTILE_95 = 1.960
 
 
-class MassifOutput(object):
-    def __init__(self, file_name):
-        self.file_name = file_name
-        log_file = open(file_name, "r")
-        self.snapshots = self._parse_snapshots(log_file)
-        log_file.close()
+# Stores the snapshots of one log file as typed columns sorted by timestamp.
+# Fields not listed in SNAPSHOT_COLUMNS are kept in plain lists, the byte
+# offsets of the "snapshot=" lines in the log file in the offsets array.
+class SnapshotTable(object):
+    def __init__(self):
+        self.ids = array.array("l")
+        self.offsets = array.array("l")
+        self.columns = dict((key, array.array("l")) for key in SNAPSHOT_COLUMNS)
+        self.extras = {}
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, snapshot_id, fields, offset=-1):
+        position = len(self.ids)
+        self.ids.append(snapshot_id)
+        self.offsets.append(offset)
+        for key in SNAPSHOT_COLUMNS:
+            self.columns[key].append(fields[key])
+        for key, value in fields.items():
+            if key in self.columns:
+                continue
+            if key not in self.extras:
+                self.extras[key] = [None] * position
+            self.extras[key].append(value)
+        for values in self.extras.values():
+            if len(values) == position:
+                values.append(None)
+
+    def sort(self):
+        timestamps = self.columns["timestamp"]
+        ids = self.ids
+        order = sorted(range(len(ids)), key=lambda position: (timestamps[position], ids[position]))
+        if order != list(range(len(ids))):
+            self.ids = array.array("l", [ids[position] for position in order])
+            self.offsets = array.array("l", [self.offsets[position] for position in order])
+            for key, column in self.columns.items():
+                self.columns[key] = array.array("l", [column[position] for position in order])
+            for key, values in self.extras.items():
+                self.extras[key] = [values[position] for position in order]
+        self.positions = dict((snapshot_id, position) for position, snapshot_id in enumerate(self.ids))
+
+    def get_position(self, snapshot_id):
+        return self.positions[snapshot_id]
+
+    def get_max_id(self):
+        return max(self.positions)
+
+    def get_offset(self, snapshot_id):
+        return self.offsets[self.positions[snapshot_id]]
+
+    def get_value(self, key, snapshot_id):
+        return self.columns[key][self.positions[snapshot_id]]
+
+    def get_record(self, position):
+        record = {}
+        for key, column in self.columns.items():
+            record[key] = column[position]
+        for key, values in self.extras.items():
+            if values[position] is not None:
+                record[key] = values[position]
+        return record
+
+
+# Read-only dict-like access to a SnapshotTable: snapshot id -> snapshot dict.
+class SnapshotView(Mapping):
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, snapshot_id):
+        return self.table.get_record(self.table.get_position(snapshot_id))
+
+    def __iter__(self):
+        return iter(sorted(self.table.positions))
+
+    def __len__(self):
+        return len(self.table)
+
+
+def _to_str(data):
+    if isinstance(data, str):
+        return data
+    return data.decode("latin-1")
 
+
+# Incremental parser of massif output. Byte chunks of any size can be fed to it,
+# only the snapshot headers are decoded, the heap trees are skipped as a whole.
+# The snapshots are collected into a SnapshotTable, or handed over to on_snapshot.
+class MassifParser(object):
     class States(object):
         NONE = 0
         ID = 1
         CONTENT = 2
 
+    def __init__(self, file_name, on_snapshot=None):
+        self.file_name = file_name
+        self.on_snapshot = on_snapshot
+        self.state = self.States.NONE
+        self.table = SnapshotTable()
+        self.current_id = None
+        self.current_fields = None
+        self.in_heap_tree = False
+        self.rest = b""
+        self.bytes_read = 0
+        # Offset of the scanned data in the log file, of the current line in the data,
+        # and of the "snapshot=" line of the current snapshot in the log file.
+        self.data_offset = 0
+        self.line_start = 0
+        self.current_offset = -1
+
+    def feed(self, chunk):
+        self.data_offset = self.bytes_read - len(self.rest)
+        self.bytes_read += len(chunk)
+        if self.rest:
+            chunk = self.rest + chunk
+        self.rest = chunk[self._scan(chunk, False):]
+
+    def close(self):
+        if self.rest:
+            self.data_offset = self.bytes_read - len(self.rest)
+            self._scan(self.rest, True)
+            self.rest = b""
+        if self.state is self.States.NONE:
+            raise IOError("The format of the %s log file is not supported! Error in parsing!" % self.file_name)
+        if self.state is self.States.ID:
+            raise IOError("The last snapshot in %s file is not complete! Error in parsing!" % self.file_name)
+        self._add_snapshot()
+        self.table.sort()
+        return self.table
+
+    def _scan(self, data, final):
+        position = 0
+        length = len(data)
+        while position < length:
+            if self.in_heap_tree:
+                if data[position:position + 1] == b"#":
+                    self.in_heap_tree = False
+                    continue
+                tree_end = data.find(b"\n#", position)
+                if tree_end != -1:
+                    position = tree_end + 1
+                    self.in_heap_tree = False
+                    continue
+                if final:
+                    return length
+                last_line_end = data.rfind(b"\n", position)
+                if last_line_end == -1:
+                    return position
+                return last_line_end + 1
+
+            line_end = data.find(b"\n", position)
+            if line_end == -1:
+                if not final:
+                    return position
+                line_end = length
+            else:
+                line_end += 1
+            self.line_start = position
+            self._parse_line(data[position:line_end])
+            position = line_end
+        return position
+
+    def _parse_line(self, line):
+        if line[:1] == b"#" and not line.rstrip(b"\n")[1:].strip(b"-"):
+            if self.state is self.States.NONE:
+                self.state = self.States.ID
+            elif self.state is self.States.ID:
+                self.state = self.States.CONTENT
+            elif self.state is self.States.CONTENT:
+                self.state = self.States.ID
+            else:
+                raise RuntimeError("Something totally unexpected happened.")
+            return
+
+        if self.state is self.States.ID:
+            split_line = _to_str(line).split("=")
+            if len(split_line) != 2 or not split_line[0] == "snapshot":
+                raise IOError("Snapshot ID cannot be parsed. Error in \"%s\" file\n"
+                              "In line %s!" % (self.file_name, split_line))
+            if self.current_fields is not None:
+                self._add_snapshot()
+            self.current_id = int(split_line[1].strip())
+            self.current_offset = self.data_offset + self.line_start
+            self.current_fields = {}
+            return
+
+        if self.state is self.States.CONTENT:
+            # Every backtrace line starts with something like "n0:",
+            # the rest of the heap tree is skipped up to the next "#" line.
+            stripped = line.lstrip()
+            if stripped[:1] == b"n":
+                colon = stripped.find(b":")
+                if colon == 1 or (colon > 1 and stripped[1:colon].isdigit()):
+                    self.in_heap_tree = True
+                    return
+            split_line = _to_str(line.strip()).split("=")
+            if len(split_line) != 2:
+                raise IOError("Error in parsing the \"%s\" file\n"
+                              "In line %s!" % (self.file_name, split_line))
+            key = split_line[0]
+            value = split_line[1]
+            if value.isdigit():
+                self.current_fields[key] = int(value)
+            else:
+                self.current_fields[key] = value
+
+    def _add_snapshot(self):
+        for key in SNAPSHOT_COLUMNS:
+            if key not in self.current_fields or isinstance(self.current_fields[key], str):
+                raise IOError("Snapshot %d in \"%s\" file has no numeric %s field! Error in parsing!"
+                              % (self.current_id, self.file_name, key))
+        if self.on_snapshot is not None:
+            self.on_snapshot(self.current_id, self.current_fields)
+        else:
+            self.table.append(self.current_id, self.current_fields, self.current_offset)
+
+
+# Interned function names, shared by the allocation trees of one measurement.
+class NameTable(object):
+    def __init__(self):
+        self.names = []
+        self.indexes = {}
+        self.descriptions = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern_description(self, description):
+        # Raw heap tree description -> interned function name. The code address
+        # differs between the call sites of a function, so it is not part of the key.
+        if description[:2] == b"0x":
+            description = description[description.find(b": ") + 2:]
+        index = self.descriptions.get(description)
+        if index is None:
+            index = self.intern(get_function_name(_to_str(description)))
+            self.descriptions[description] = index
+        return index
+
+    def intern(self, name):
+        index = self.indexes.get(name)
+        if index is None:
+            index = len(self.names)
+            self.indexes[name] = index
+            self.names.append(name)
+        return index
+
+    def get_name(self, index):
+        return self.names[index]
+
+
+def get_function_name(description):
+    # "0x4005D4: QString::reallocData(int) (qstring.cpp:10)" -> "QString::reallocData(int)"
+    if description.startswith("in ") and " place" in description:
+        return BELOW_THRESHOLD_NAME
+    match = re.match("^(?:0x[0-9A-Fa-f]+: )?(.*?)( \\((?:[^()]*:\\d+|in [^()]*)\\))?$", description)
+    if match:
+        return match.group(1)
+    return description
+
+
+# The heap tree of one detailed snapshot. The nodes are numbered in the order of
+# the log file, their bytes and interned function names are kept in arrays, and
+# the children of every node form one contiguous block of the children array.
+class AllocationTree(object):
+    def __init__(self, names):
+        self.names = names
+        self.bytes = array.array("l")
+        self.functions = array.array("l")
+        self.child_starts = array.array("l")
+        self.child_counts = array.array("l")
+        self.children = array.array("l")
+
+    def __len__(self):
+        return len(self.bytes)
+
+    def get_bytes(self, node):
+        return self.bytes[node]
+
+    def get_function(self, node):
+        return self.names.get_name(self.functions[node])
+
+    def get_children(self, node):
+        start = self.child_starts[node]
+        return self.children[start:start + self.child_counts[node]]
+
+    def get_allocation_sites(self):
+        # (interned function, bytes) of the callers of the allocation functions.
+        if not len(self):
+            return []
+        return [(self.functions[node], self.bytes[node]) for node in self.get_children(0)]
+
+
+def parse_heap_tree(lines, names, file_name, snapshot_id):
+    tree = AllocationTree(names)
+    tree_bytes = tree.bytes
+    functions = tree.functions
+    child_starts = tree.child_starts
+    child_counts = tree.child_counts
+    children = tree.children
+    # (node, number of its children already read)
+    stack = []
+    for line in lines:
+        parts = line.split(None, 2)
+        if not parts:
+            continue
+        try:
+            if parts[0][:1] != b"n" or parts[0][-1:] != b":" or (not stack and tree_bytes):
+                raise ValueError()
+            child_count = int(parts[0][1:-1])
+            size = int(parts[1])
+        except (ValueError, IndexError):
+            raise IOError("Error in parsing the heap tree of snapshot %d in \"%s\" file\n"
+                          "In line %s!" % (snapshot_id, file_name, _to_str(line).strip()))
+        description = parts[2].rstrip() if len(parts) > 2 else b""
+        node = len(tree_bytes)
+        tree_bytes.append(size)
+        child_starts.append(len(children))
+        child_counts.append(child_count)
+        if child_count:
+            children.extend([-1] * child_count)
+        if stack:
+            functions.append(names.intern_description(description))
+            parent, read_children = stack[-1]
+            children[child_starts[parent] + read_children] = node
+            if read_children + 1 == child_counts[parent]:
+                stack.pop()
+            else:
+                stack[-1] = (parent, read_children + 1)
+        else:
+            # The root is the pseudo function of the allocation functions.
+            functions.append(names.intern(_to_str(description)))
+        if child_count:
+            stack.append((node, 0))
+    if stack:
+        raise IOError("The heap tree of snapshot %d in \"%s\" file is not complete! Error in parsing!"
+                      % (snapshot_id, file_name))
+    return tree
+
+
+# On-disk cache of parsed SnapshotTables, one entry per log file. An entry is only
+# used while the path, size and mtime of the log file and the parser version match.
+# The least recently used entries are removed once the directory exceeds max_size.
+# The total size of the entries is kept in an index file, so the directory is only
+# listed when the total goes above max_size or the index is missing.
+class SnapshotCache(object):
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _get_entry_path(self, file_name):
+        digest = hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".cache")
+
+    def _get_key(self, file_name):
+        return get_log_file_key(file_name) + [PARSER_VERSION]
+
+    def load(self, file_name):
+        entry_path = self._get_entry_path(file_name)
+        try:
+            with open(entry_path, "rb") as entry:
+                if entry.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                    return None
+                header_length = struct.unpack("<I", entry.read(4))[0]
+                header = json.loads(entry.read(header_length).decode("utf-8"))
+                if header["key"] != self._get_key(file_name) or \
+                   header["itemsize"] != array.array("l").itemsize or header["byteorder"] != sys.byteorder:
+                    return None
+                table = SnapshotTable()
+                table.ids.fromfile(entry, header["count"])
+                table.offsets.fromfile(entry, header["count"])
+                for key in SNAPSHOT_COLUMNS:
+                    table.columns[key].fromfile(entry, header["count"])
+                table.extras = header["extras"]
+            os.utime(entry_path, None)
+        except (IOError, OSError, EOFError, ValueError, KeyError, struct.error):
+            return None
+        table.sort()
+        return table
+
+    def store(self, file_name, table):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        header = json.dumps({"key": self._get_key(file_name),
+                             "count": len(table),
+                             "itemsize": table.ids.itemsize,
+                             "byteorder": sys.byteorder,
+                             "extras": table.extras}).encode("utf-8")
+        entry_path = self._get_entry_path(file_name)
+        temporary_path = "%s.%d.tmp" % (entry_path, os.getpid())
+        with open(temporary_path, "wb") as entry:
+            entry.write(CACHE_MAGIC)
+            entry.write(struct.pack("<I", len(header)))
+            entry.write(header)
+            table.ids.tofile(entry)
+            table.offsets.tofile(entry)
+            for key in SNAPSHOT_COLUMNS:
+                table.columns[key].tofile(entry)
+        size_change = os.path.getsize(temporary_path)
+        if os.path.exists(entry_path):
+            size_change -= os.path.getsize(entry_path)
+        os.rename(temporary_path, entry_path)
+        total_size = self._update_index(lambda total: total + size_change if total is not None else None)
+        if total_size is None or total_size > self.max_size:
+            self._evict()
+
+    def _update_index(self, update):
+        # Replaces the total in the index file with update(total), the total is None if it is unknown.
+        with open(os.path.join(self.directory, CACHE_INDEX_NAME), "a+") as index:
+            fcntl.flock(index, fcntl.LOCK_EX)
+            index.seek(0)
+            try:
+                total_size = int(index.read())
+            except ValueError:
+                total_size = None
+            total_size = update(total_size)
+            if total_size is not None:
+                index.seek(0)
+                index.truncate()
+                index.write("%d" % total_size)
+            return total_size
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for entry_name in os.listdir(self.directory):
+            if not entry_name.endswith(".cache"):
+                continue
+            entry_path = os.path.join(self.directory, entry_name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total_size += stat.st_size
+        if total_size > self.max_size:
+            for last_used, size, entry_path in sorted(entries):
+                if total_size <= self.max_size * CACHE_EVICTION_TARGET:
+                    break
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    continue
+                total_size -= size
+        self._update_index(lambda total: total_size)
+
+
+def split_archive_path(file_name):
+    # "site.tar/1-.out123.gz" -> ("site.tar", "1-.out123.gz"), (None, file_name) for other files.
+    if os.path.exists(file_name):
+        return None, file_name
+    archive = file_name
+    while True:
+        parent = os.path.dirname(archive)
+        # "" for relative paths, the root stays its own parent.
+        if not parent or parent == archive:
+            return None, file_name
+        archive = parent
+        if archive.endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(archive):
+            return archive, file_name[len(archive):].lstrip(os.sep)
+
+
+# Open tar archives per process, the member index of an archive is only read
+# once. The pool workers must not share the file position of the parent.
+_archives = {}
+
+
+def open_archive(archive):
+    # The tar file and its regular members by normalised name ("./1-.out1" -> "1-.out1").
+    key = (archive, os.getpid())
+    if key not in _archives:
+        tar = tarfile.open(archive, "r:*")
+        members = dict((os.path.normpath(member.name), member) for member in tar.getmembers() if member.isfile())
+        _archives[key] = (tar, members)
+    return _archives[key]
+
+
+def list_archive(archive):
+    return sorted(open_archive(archive)[1])
+
+
+def get_log_file_key(file_name):
+    # Size and mtime of the log file, or of its archive.
+    archive, member = split_archive_path(file_name)
+    stat = os.stat(archive or file_name)
+    return [os.path.abspath(file_name), stat.st_size, stat.st_mtime]
+
+
+def _decompress(log_file, file_name):
+    if file_name.endswith(".gz"):
+        return gzip.GzipFile(fileobj=log_file, mode="rb")
+    if file_name.endswith(".xz"):
+        if lzma is None:
+            raise IOError("Reading the \"%s\" file needs the lzma module!" % file_name)
+        return lzma.LZMAFile(log_file, "rb")
+    if file_name.endswith(".zst"):
+        if zstandard is None:
+            raise IOError("Reading the \"%s\" file needs the zstandard module!" % file_name)
+        return zstandard.ZstdDecompressor().stream_reader(log_file)
+    return log_file
+
+
+def open_log_file(file_name):
+    # Binary stream of a plain, compressed or archived log file, decompressed while it is read.
+    archive, member = split_archive_path(file_name)
+    if archive is None:
+        return _decompress(open(file_name, "rb"), file_name)
+    tar, members = open_archive(archive)
+    if os.path.normpath(member) not in members:
+        raise IOError("There is no \"%s\" file in the \"%s\" archive!" % (member, archive))
+    log_file = tar.extractfile(members[os.path.normpath(member)])
+    return _decompress(log_file, member)
+
+
+def is_plain_log_file(file_name):
+    return not file_name.endswith(COMPRESSED_EXTENSIONS) and split_archive_path(file_name)[0] is None
+
+
+class MassifOutput(object):
+    def __init__(self, file_name, cache=None):
+        self.file_name = file_name
+        self.parsed_bytes = 0
+        started = time.time()
+        self.table = None
+        if cache is not None:
+            self.table = cache.load(file_name)
+        self.from_cache = self.table is not None
+        if self.table is None:
+            log_file = open_log_file(file_name)
+            self.table = self._parse_snapshots(log_file)
+            log_file.close()
+            if cache is not None:
+                self._store_in_cache(cache)
+        self.parse_time = time.time() - started
+        self.snapshots = SnapshotView(self.table)
+        self.search_index = None
+        self.lookup_index = None
+        self.detailed_positions = None
+        self.file_offsets = None
+        self.mapping = None
+
+    def _store_in_cache(self, cache):
+        try:
+            cache.store(self.file_name, self.table)
+        except (IOError, OSError) as err:
+            sys.stderr.write("Cannot cache the parsed %s file: %s\n" % (self.file_name, str(err)))
+
     def get_file_name(self):
         return self.file_name
 
+    def get_pid(self):
+        match = re.search("\\.out(\\d+)", os.path.basename(self.file_name))
+        if match:
+            return int(match.group(1))
+        return None
+
+    def is_from_cache(self):
+        return self.from_cache
+
     def get_snapshots(self):
         return self.snapshots
 
-    def _parse_snapshots(self, log_file):
-        current_id = None
-        state = self.States.NONE
-        snapshots = {}
-        for line in log_file:
-            if re.match("^#-*$", line):
-                if state is self.States.NONE:
-                    state = self.States.ID
-                    continue
-                if state is self.States.ID:
-                    state = self.States.CONTENT
-                    continue
-                if state is self.States.CONTENT:
-                    state = self.States.ID
-                    continue
-                else:
-                    raise RuntimeError("Something totally unexpected happened.")
-
-            if state is self.States.ID:
-                split_line = line.split("=")
-                if len(split_line) is not 2 or not split_line[0] == "snapshot":
-                    raise IOError("Snapshot ID cannot be parsed. Error in \"%s\" file\n"
-                                    "In line %s!" % (log_file.name, split_line))
-                current_id = int(split_line[1].strip())
-                snapshots[current_id] = {}
-                continue
+    def get_table(self):
+        return self.table
 
-            if state is self.States.CONTENT:
-                # Check if the line is part of the backtrace.
-                # Every backtrace starts with something like "n0:".
-                if re.match("^\s*n\d*:", line):
-                    continue
-                line = line.strip()
-                split_line = line.split("=")
-                if len(split_line) is not 2:
-                    raise IOError("Error in parsing the \"%s\" file\n"
-                                    "In line %s!" % (log_file.name, split_line))
-                key = split_line[0]
-                value = split_line[1]
-                if value.isdigit():
-                    snapshots[current_id][key] = int(value)
-                else:
-                    snapshots[current_id][key] = value
-                continue
+    def get_parsed_bytes(self):
+        return self.parsed_bytes
+
+    def get_parse_time(self):
+        return self.parse_time
+
+    def get_parse_throughput(self):
+        if self.parse_time <= 0:
+            return float("inf")
+        return float(self.parsed_bytes) / TO_MEGA / self.parse_time
 
-        if state is self.States.NONE:
-            raise IOError("The format of the %s log file is not supported! Error in parsing!" % log_file.name)
-        if state is self.States.ID:
-            raise IOError("The last snapshot in %s file is not complete! Error in parsing!" % log_file.name)
-        return snapshots
+    def _parse_snapshots(self, log_file):
+        parser = MassifParser(self.file_name)
+        while True:
+            chunk = log_file.read(PARSE_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        table = parser.close()
+        self.parsed_bytes = parser.bytes_read
+        return table
 
     def get_run_length(self):
-        max_key = max(self.snapshots.keys())
-        process_run_length = (float(self.snapshots[max_key]["timestamp"]) - self.snapshots[0]["timestamp"]) / 1000000
+        max_key = self.table.get_max_id()
+        process_run_length = (float(self.table.get_value("timestamp", max_key)) -
+                              self.table.get_value("timestamp", 0)) / 1000000
         return process_run_length
 
     def get_snapshot_per_sec(self):
-        max_key = max(self.snapshots.keys())
+        max_key = self.table.get_max_id()
         process_run_length = self.get_run_length()
         return max_key / process_run_length
 
     def get_snapshot(self, snapshot_id):
-        max_key = max(self.snapshots.keys())
+        max_key = self.table.get_max_id()
         if snapshot_id <= 0:
             return self.snapshots[0]
         elif snapshot_id >= max_key:
             return self.snapshots[max_key]
         return self.snapshots[snapshot_id]
 
+    def _get_lookup_index(self):
+        # (timestamp, mem_heap_B) -> positions of the snapshots with these values.
+        if self.lookup_index is None:
+            self.lookup_index = {}
+            keys = zip(self.table.columns["timestamp"], self.table.columns["mem_heap_B"])
+            for position, key in enumerate(keys):
+                self.lookup_index.setdefault(key, []).append(position)
+        return self.lookup_index
+
     def get_snapshot_id(self, wanted_snapshot):
-        for snapshot_id, snapshot in self.snapshots.items():
-            if snapshot == wanted_snapshot:
-                return snapshot_id
+        key = (wanted_snapshot.get("timestamp"), wanted_snapshot.get("mem_heap_B"))
+        for position in self._get_lookup_index().get(key, ()):
+            if self.table.get_record(position) == wanted_snapshot:
+                return self.table.ids[position]
         return None
 
-    def get_nearest_snapshots(self, base_snapshot):
+    def _get_search_index(self):
+        # Timestamps and ids of the snapshots that can be matched, the 0th one never is.
+        if self.search_index is None:
+            timestamps = array.array("l")
+            ids = array.array("l")
+            all_timestamps = self.table.columns["timestamp"]
+            for position, snapshot_id in enumerate(self.table.ids):
+                if snapshot_id != 0:
+                    timestamps.append(all_timestamps[position])
+                    ids.append(snapshot_id)
+            self.search_index = (timestamps, ids)
+        return self.search_index
+
+    def _pick_nearest_id(self, timestamps, ids, position, base_timestamp):
+        # position is the first snapshot not earlier than base_timestamp. On equal
+        # distance the smaller snapshot id wins.
         nearest_snapshot_id = None
-        minimum_difference = sys.maxint
-        nearest_snapshots = []
-        if base_snapshot["timestamp"] < self.snapshots[0]["timestamp"]:
+        minimum_difference = MAX_SNAPSHOT_DIFF
+        if position < len(timestamps):
+            minimum_difference = timestamps[position] - base_timestamp
+            if minimum_difference < MAX_SNAPSHOT_DIFF:
+                nearest_snapshot_id = ids[position]
+            else:
+                minimum_difference = MAX_SNAPSHOT_DIFF
+        if position > 0:
+            previous_timestamp = timestamps[position - 1]
+            current_difference = base_timestamp - previous_timestamp
+            if current_difference <= minimum_difference and current_difference < MAX_SNAPSHOT_DIFF:
+                previous_id = ids[bisect.bisect_left(timestamps, previous_timestamp, 0, position)]
+                if current_difference < minimum_difference or previous_id < nearest_snapshot_id:
+                    nearest_snapshot_id = previous_id
+        return nearest_snapshot_id
+
+    def get_nearest_snapshot_id(self, base_timestamp):
+        if base_timestamp < self.table.get_value("timestamp", 0):
             return None
-        for (snapshot_id, snapshot) in sorted(self.snapshots.items()):
-            if snapshot_id is 0:
+        timestamps, ids = self._get_search_index()
+        position = bisect.bisect_left(timestamps, base_timestamp)
+        return self._pick_nearest_id(timestamps, ids, position, base_timestamp)
+
+    def get_nearest_snapshot_ids(self, base_timestamps):
+        # Merge join of the base timestamps with the sorted timestamps of this file.
+        # Falls back to bisection whenever the base timestamps step backwards.
+        timestamps, ids = self._get_search_index()
+        first_timestamp = self.table.get_value("timestamp", 0)
+        nearest_ids = []
+        position = 0
+        previous_base_timestamp = None
+        for base_timestamp in base_timestamps:
+            if base_timestamp < first_timestamp:
+                nearest_ids.append(None)
                 continue
+            if previous_base_timestamp is not None and base_timestamp < previous_base_timestamp:
+                position = bisect.bisect_left(timestamps, base_timestamp)
+            while position < len(timestamps) and timestamps[position] < base_timestamp:
+                position += 1
+            nearest_ids.append(self._pick_nearest_id(timestamps, ids, position, base_timestamp))
+            previous_base_timestamp = base_timestamp
+        return nearest_ids
 
-            current_difference = abs(base_snapshot["timestamp"] - snapshot["timestamp"])
-            if current_difference < minimum_difference and current_difference < MAX_SNAPSHOT_DIFF:
-                minimum_difference = current_difference
-                nearest_snapshot_id = snapshot_id
+    def get_snapshot_ids_around(self, nearest_snapshot_id):
+        max_key = self.table.get_max_id()
+        if nearest_snapshot_id == 1:
+            snapshot_ids = [nearest_snapshot_id, nearest_snapshot_id + 1]
+        elif nearest_snapshot_id == max_key:
+            snapshot_ids = [nearest_snapshot_id - 1, nearest_snapshot_id]
+        else:
+            snapshot_ids = [nearest_snapshot_id - 1, nearest_snapshot_id, nearest_snapshot_id + 1]
+        return [min(max(snapshot_id, 0), max_key) for snapshot_id in snapshot_ids]
 
+    def get_snapshots_around(self, nearest_snapshot_id):
+        return [self.snapshots[snapshot_id] for snapshot_id in self.get_snapshot_ids_around(nearest_snapshot_id)]
+
+    def get_nearest_snapshots(self, base_snapshot):
+        nearest_snapshot_id = self.get_nearest_snapshot_id(base_snapshot["timestamp"])
         if nearest_snapshot_id is None:
             return None
+        return self.get_snapshots_around(nearest_snapshot_id)
 
-        if nearest_snapshot_id is 1:
-            nearest_snapshots.append(self.get_snapshot(nearest_snapshot_id))
-            nearest_snapshots.append(self.get_snapshot(nearest_snapshot_id + 1))
-        elif nearest_snapshot_id is max(self.snapshots.keys()):
-            nearest_snapshots.append(self.get_snapshot(nearest_snapshot_id - 1))
-            nearest_snapshots.append(self.get_snapshot(nearest_snapshot_id))
-        else:
-            nearest_snapshots.append(self.get_snapshot(nearest_snapshot_id - 1))
-            nearest_snapshots.append(self.get_snapshot(nearest_snapshot_id))
-            nearest_snapshots.append(self.get_snapshot(nearest_snapshot_id + 1))
-        return nearest_snapshots
+    def _get_detailed_positions(self):
+        if self.detailed_positions is None:
+            heap_trees = self.table.extras.get("heap_tree", ())
+            self.detailed_positions = array.array("l", [position for position, heap_tree in enumerate(heap_trees)
+                                                        if heap_tree in DETAILED_HEAP_TREES])
+        return self.detailed_positions
+
+    def get_detailed_snapshot_id(self, snapshot_id):
+        # The snapshot itself if it has a heap tree, otherwise the detailed snapshot nearest in time.
+        detailed_positions = self._get_detailed_positions()
+        if not detailed_positions:
+            return None
+        position = self.table.get_position(snapshot_id)
+        index = bisect.bisect_left(detailed_positions, position)
+        candidates = detailed_positions[max(index - 1, 0):index + 1]
+        timestamps = self.table.columns["timestamp"]
+        nearest = min(candidates, key=lambda candidate: abs(timestamps[candidate] - timestamps[position]))
+        return self.table.ids[nearest]
+
+    def _get_mapping(self):
+        # The log file is mapped only when a snapshot body is needed,
+        # compressed and archived log files are decompressed into memory.
+        if self.mapping is None:
+            if is_plain_log_file(self.file_name):
+                with open(self.file_name, "rb") as log_file:
+                    self.mapping = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                log_file = open_log_file(self.file_name)
+                self.mapping = log_file.read()
+                log_file.close()
+        return self.mapping
+
+    def close(self):
+        if isinstance(self.mapping, mmap.mmap):
+            self.mapping.close()
+        self.mapping = None
+
+    def get_snapshot_body(self, snapshot_id):
+        # The bytes of the snapshot from its "snapshot=" line up to the next snapshot.
+        if self.file_offsets is None:
+            self.file_offsets = array.array("l", sorted(self.table.offsets))
+        mapping = self._get_mapping()
+        offset = self.table.get_offset(snapshot_id)
+        if offset < 0:
+            raise IOError("The offset of snapshot %d in \"%s\" file is unknown!" % (snapshot_id, self.file_name))
+        next_position = bisect.bisect_right(self.file_offsets, offset)
+        end = self.file_offsets[next_position] if next_position < len(self.file_offsets) else len(mapping)
+        return mapping[offset:end]
+
+    def get_heap_tree(self, snapshot_id, names):
+        body = self.get_snapshot_body(snapshot_id)
+        heap_tree = body.find(b"\nheap_tree=")
+        if heap_tree == -1:
+            return None
+        tree_start = body.find(b"\n", heap_tree + 1) + 1
+        if tree_start == 0:
+            tree_start = len(body)
+        tree_end = body.find(b"\n#", tree_start)
+        if tree_end == -1:
+            tree_end = len(body)
+        return parse_heap_tree(body[tree_start:tree_end].split(b"\n"), names, self.file_name, snapshot_id)
 
     def get_start_end_time(self):
-        max_key = max(self.snapshots.keys())
-        start = self.get_snapshots()[0]["timestamp"]
-        end = self.get_snapshots()[max_key]["timestamp"]
-        TimeInterval = collections.namedtuple("TimeInterval", ["start", "end"])
-        time = TimeInterval(start, end)
-        return time
+        start = self.table.get_value("timestamp", 0)
+        end = self.table.get_value("timestamp", self.table.get_max_id())
+        return TimeInterval(start, end)
 
     def __contains__(self, wanted_snapshot):
-        for (snapshot_id, snapshot) in self.snapshots.items():
-            if wanted_snapshot["timestamp"] == snapshot["timestamp"] and \
-               wanted_snapshot["mem_heap_B"] == snapshot["mem_heap_B"]:
-                return True
-        return False
+        return (wanted_snapshot["timestamp"], wanted_snapshot["mem_heap_B"]) in self._get_lookup_index()
 
     def __str__(self):
-        string = ""
-        snapshots = self.get_snapshots()
-        for (snapshot_id, snapshot) in snapshots.items():
-            if snapshot_id is not max(snapshots.keys()):
-                snapshot_string = "Timestamp: %d, Used memory: %d\n" % (snapshot["timestamp"], snapshot["mem_heap_B"])
-            else:
-                snapshot_string = "Timestamp: %d, Used memory: %d" % (snapshot["timestamp"], snapshot["mem_heap_B"])
-            string += snapshot_string
-        return string
+        lines = []
+        for snapshot_id in sorted(self.table.positions):
+            lines.append("Timestamp: %d, Used memory: %d" % (self.table.get_value("timestamp", snapshot_id),
+                                                             self.table.get_value("mem_heap_B", snapshot_id)))
+        return "\n".join(lines)
+
+
+# A massif output file followed while it is being written. Only the last
+# window snapshots are kept as (timestamp, mem_heap_B, mem_heap_extra_B),
+# on_evict is called with the process before the oldest one is dropped.
+class FollowedProcess(object):
+    def __init__(self, file_name, window, on_evict=None):
+        self.file_name = file_name
+        self.descriptor = os.open(file_name, os.O_RDONLY)
+        self.parser = MassifParser(file_name, self._add_snapshot)
+        self.snapshots = collections.deque(maxlen=window)
+        self.on_evict = on_evict
+        self.new_timestamps = []
+        self.unparsed = b""
+        self.finished = False
+
+    def _add_snapshot(self, snapshot_id, fields):
+        if len(self.snapshots) == self.snapshots.maxlen and self.on_evict is not None:
+            self.on_evict(self)
+        self.snapshots.append((fields["timestamp"], fields["mem_heap_B"], fields["mem_heap_extra_B"]))
+        self.new_timestamps.append(fields["timestamp"])
+
+    def get_file_name(self):
+        return self.file_name
+
+    def is_finished(self):
+        return self.finished
+
+    def read(self, max_snapshots=None):
+        # Feeds the parser with the new data of the file, but only up to the start of
+        # the max_snapshots-th next snapshot. Returns the bytes read and whether the
+        # end of the file was reached.
+        bytes_read = 0
+        parsed_snapshots = 0
+        while not self.finished:
+            if not self.unparsed:
+                chunk = os.read(self.descriptor, PARSE_CHUNK_SIZE)
+                if not chunk:
+                    return bytes_read, True
+                bytes_read += len(chunk)
+                self.unparsed = chunk
+            end = len(self.unparsed)
+            if max_snapshots is not None:
+                position = -1
+                for snapshot in range(max_snapshots - parsed_snapshots):
+                    position = self.unparsed.find(b"\nsnapshot=", position + 1)
+                    if position == -1:
+                        break
+                if position != -1:
+                    end = position + 1
+            parsed_snapshots += self.unparsed.count(b"\nsnapshot=", 0, end)
+            self.parser.feed(self.unparsed[:end])
+            self.unparsed = self.unparsed[end:]
+            if self.unparsed:
+                return bytes_read, False
+        return bytes_read, True
+
+    def finish(self):
+        # Raises IOError if the file is empty or ends in the middle of a snapshot,
+        # the snapshots read before stay usable.
+        if self.finished:
+            return
+        self.read()
+        os.close(self.descriptor)
+        self.finished = True
+        self.parser.close()
+
+    def pop_new_timestamps(self):
+        new_timestamps = self.new_timestamps
+        self.new_timestamps = []
+        return new_timestamps
+
+    def get_latest_timestamp(self):
+        if len(self.snapshots) == 0:
+            return None
+        return self.snapshots[-1][0]
+
+    def get_nearest_snapshot(self, timestamp):
+        nearest_snapshot = None
+        minimum_difference = MAX_SNAPSHOT_DIFF
+        for snapshot in self.snapshots:
+            current_difference = abs(timestamp - snapshot[0])
+            if current_difference < minimum_difference:
+                minimum_difference = current_difference
+                nearest_snapshot = snapshot
+        return nearest_snapshot
+
+
+# Follows the massif output files starting with prefix while the measurement
+# is running and keeps the combined peak up to date. The memory of the processes
+# is summed at every snapshot time, once every followed process has reached it,
+# more than window snapshot times are waiting, or a snapshot the time may need
+# is about to leave the window of its process. The files are read in steps of
+# half a window, always the one that is behind in time first.
+class PeakTracker(object):
+    def __init__(self, prefix, window, ceiling=None):
+        self.prefix = prefix
+        self.window = window
+        self.ceiling = ceiling
+        self.processes = collections.OrderedDict()
+        self.pending = []
+        self.peak_memory = 0
+        self.peak_heap = 0
+        self.peak_timestamp = None
+        self.peak_processes = 0
+        self.ceiling_crossed = False
+
+    def get_peak_heap(self):
+        return self.peak_heap
+
+    def get_peak_timestamp(self):
+        return self.peak_timestamp
+
+    def get_peak_processes(self):
+        return self.peak_processes
+
+    def is_ceiling_crossed(self):
+        return self.ceiling_crossed
+
+    def _discover_files(self):
+        directory, file_prefix = os.path.split(self.prefix)
+        for file_name in sorted(os.listdir(directory or ".")):
+            file_name = os.path.join(directory, file_name)
+            if os.path.basename(file_name).startswith(file_prefix) and file_name not in self.processes:
+                try:
+                    self.processes[file_name] = FollowedProcess(file_name, self.window, self._before_evict)
+                except OSError:
+                    continue
 
+    def _push_new_timestamps(self, process):
+        for timestamp in process.pop_new_timestamps():
+            heapq.heappush(self.pending, timestamp)
 
+    def _before_evict(self, process):
+        # The oldest snapshot of process is the nearest one only for the times before the second oldest.
+        self._push_new_timestamps(process)
+        limit = process.snapshots[1][0] if len(process.snapshots) > 1 else process.snapshots[0][0]
+        while self.pending and self.pending[0] <= limit:
+            self._evaluate(heapq.heappop(self.pending))
+
+    def poll(self):
+        self._discover_files()
+        bytes_read = 0
+        step = max(1, self.window // 2)
+        readable = [process for process in self.processes.values() if not process.is_finished()]
+        while readable:
+            process = min(readable, key=lambda process: (process.get_latest_timestamp() is not None,
+                                                            process.get_latest_timestamp()))
+            process_bytes, at_end = process.read(step)
+            bytes_read += process_bytes
+            if at_end:
+                readable.remove(process)
+            self._push_new_timestamps(process)
+            self._evaluate_pending(False)
+        return bytes_read
+
+    def finish(self):
+        self.poll()
+        for process in self.processes.values():
+            try:
+                process.finish()
+            except IOError as err:
+                sys.stderr.write("Only the complete snapshots of %s are used: %s\n"
+                                 % (process.get_file_name(), str(err)))
+            self._push_new_timestamps(process)
+        self._evaluate_pending(True)
+
+    def _is_settled(self, timestamp):
+        for process in self.processes.values():
+            latest_timestamp = process.get_latest_timestamp()
+            if not process.is_finished() and latest_timestamp is not None and latest_timestamp < timestamp:
+                return False
+        return True
+
+    def _evaluate_pending(self, final):
+        pending_limit = self.window * max(1, len(self.processes))
+        while self.pending:
+            timestamp = self.pending[0]
+            if not final and len(self.pending) <= pending_limit and not self._is_settled(timestamp):
+                break
+            heapq.heappop(self.pending)
+            self._evaluate(timestamp)
+
+    def _evaluate(self, timestamp):
+        used_memory = 0
+        used_heap = 0
+        used_processes = 0
+        for process in self.processes.values():
+            snapshot = process.get_nearest_snapshot(timestamp)
+            if snapshot is not None:
+                used_heap += snapshot[1]
+                used_memory += snapshot[1] + snapshot[2]
+                used_processes += 1
+        if used_memory > self.peak_memory:
+            self.peak_memory = used_memory
+            self.peak_heap = used_heap
+            self.peak_timestamp = timestamp
+            self.peak_processes = used_processes
+        if self.ceiling is not None and used_heap > self.ceiling:
+            self.ceiling_crossed = True
+
+
+# on_stage is called with the name of every analysis stage when it starts,
+# and with None when the result is ready.
 class ResultGenerator(object):
-    def __init__(self, output_list):
+    def __init__(self, output_list, on_stage=None):
+        self.on_stage = on_stage
+        self._start_stage("covered_interval")
         self.parent_output = self._get_parent_output(output_list)
         self.children_output = self._get_children_output(output_list)
-        self.snapshots_to_use = self._get_snapshots_to_use()
+        self.covered_time = None
+        self.interval = None
+        self.get_min_max_of_interval()
+        self._start_stage("nearest_matching")
+        self.sources_to_use = self._get_sources_to_use()
+        self._start_stage("peak_selection")
+        self.position_matrix = self._get_position_matrix()
         self.useful_memories = self._calculate_useful_memories()
         self.extra_memories = self._calculate_extra_memories()
         self.found_nearest_snapshots_percentage = self._calculate_percentage()
-        self.chosen_snapshots = self._get_snapshots_with_max_memory()
+        self.chosen_snapshots, self.chosen_sources = self._get_snapshots_with_max_memory()
+        self._start_stage(None)
+
+    def _start_stage(self, stage):
+        if self.on_stage is not None:
+            self.on_stage(stage)
 
     def get_chosen_snapshots(self):
         return self.chosen_snapshots
 
+    def get_chosen_sources(self):
+        return self.chosen_sources
+
+    def get_found_nearest_snapshots_percentage(self):
+        return self.found_nearest_snapshots_percentage
+
+    def get_useful_memory(self):
+        return self._calculate_useful_memory(self.chosen_snapshots)
+
+    def get_extra_memory(self):
+        return self._calculate_extra_memory(self.chosen_snapshots)
+
     def get_parent_output(self):
         return self.parent_output
 
@@ -183,8 +1094,9 @@ class ResultGenerator(object):
         parent_output = None
         minimum_time = sys.maxint
         for massif_output in output_list:
-            if massif_output.get_snapshots()[0]["timestamp"] < minimum_time:
-                minimum_time = massif_output.get_snapshots()[0]["timestamp"]
+            start_time = massif_output.get_start_end_time().start
+            if start_time < minimum_time:
+                minimum_time = start_time
                 parent_output = massif_output
         """for massif_output in output_list:
             # TODO: check first timestamp
@@ -202,16 +1114,14 @@ class ResultGenerator(object):
         return children_output
 
     def _get_snapshots_with_max_memory(self):
-        chosen_snapshots = []
-        max_memory = 0
-        for snapshot_vector in self.snapshots_to_use:
-            used_memory = self._calculate_useful_memory(snapshot_vector) + self._calculate_extra_memory(snapshot_vector)
-            if used_memory > max_memory:
-                max_memory = used_memory
-                del chosen_snapshots[:]
-                for snapshot in snapshot_vector:
-                    chosen_snapshots.append(snapshot)
-        return chosen_snapshots
+        # The first vector with the largest mem_heap_B + mem_heap_extra_B.
+        total_memories = [useful + extra for useful, extra in zip(self.useful_memories, self.extra_memories)]
+        if not total_memories or max(total_memories) <= 0:
+            return [], []
+        peak_vector = total_memories.index(max(total_memories))
+        chosen_sources = list(self.sources_to_use[peak_vector])
+        chosen_snapshots = [output.get_snapshots()[snapshot_id] for output, snapshot_id in chosen_sources]
+        return chosen_snapshots, chosen_sources
 
     def _calculate_useful_memory(self, snapshot_vector):
         used_memory = 0
@@ -225,96 +1135,138 @@ class ResultGenerator(object):
             extra_memory += snapshot["mem_heap_extra_B"]
         return extra_memory
 
+    def _get_position_matrix(self):
+        # One column per process (the parent first) with the table position of its
+        # snapshot in every vector, -1 where the process has no snapshot in the vector.
+        outputs = [self.parent_output] + self.children_output
+        columns = dict((id(output), index) for index, output in enumerate(outputs))
+        matrix = [array.array("l", [-1]) * len(self.sources_to_use) for output in outputs]
+        for vector, source_vector in enumerate(self.sources_to_use):
+            for output, snapshot_id in source_vector:
+                matrix[columns[id(output)]][vector] = output.get_table().get_position(snapshot_id)
+        return matrix
+
+    def _sum_column(self, key):
+        # Sum of the key column of the used snapshots of every vector.
+        outputs = [self.parent_output] + self.children_output
+        rows = []
+        for output, positions in zip(outputs, self.position_matrix):
+            values = output.get_table().columns[key]
+            rows.append([values[position] if position >= 0 else 0 for position in positions])
+        return [sum(vector) for vector in zip(*rows)]
+
     def _calculate_useful_memories(self):
-        useful_memories = []
-        for snapshot_vector in self.snapshots_to_use:
-            used_memory = 0
-            for snapshot in snapshot_vector:
-                used_memory += snapshot["mem_heap_B"]
-            useful_memories.append(used_memory)
-        return useful_memories
+        return self._sum_column("mem_heap_B")
 
     def _calculate_extra_memories(self):
-        extra_memories = []
-        for snapshot_vector in self.snapshots_to_use:
-            extra_memory = 0
-            for snapshot in snapshot_vector:
-                extra_memory += snapshot["mem_heap_extra_B"]
-            extra_memories.append(extra_memory)
-        return extra_memories
+        return self._sum_column("mem_heap_extra_B")
 
     def _calculate_percentage(self):
-
-        match_counter = 0
+        # Vectors of the covered interval in which at least one child has a snapshot.
         interval = self.get_min_max_of_interval()
         interval_len = interval.maximum_end - interval.minimum_start
-        for snapshot_vector in range(interval.minimum_start, interval.maximum_end + 1):
-            if len(self.snapshots_to_use[snapshot_vector]) is not 1:
-                match_counter += 1
-        percentage = match_counter / float(interval_len) * 100
+        first = max(interval.minimum_start, 0)
+        matched = [False] * max(interval.maximum_end + 1 - first, 0)
+        for positions in self.position_matrix[1:]:
+            matched = [found or position >= 0
+                       for found, position in zip(matched, positions[first:interval.maximum_end + 1])]
+        percentage = sum(matched) / float(interval_len) * 100
         return percentage
 
-    def _get_snapshots_to_use(self):
-        max_key = max(self.parent_output.get_snapshots().keys())
-        snapshots_to_use = []
-        parent_snapshots = self.parent_output.get_snapshots()
+    def _get_sources_to_use(self):
+        # Every vector lists the (MassifOutput, snapshot id) pairs of the snapshots used together.
+        parent_output = self.parent_output
+        parent_table = parent_output.get_table()
+        max_key = parent_table.get_max_id()
+        sources_to_use = []
 
-        if len(self.children_output) is 0:
-            for parent_snapshot in parent_snapshots.values():
-                snapshots_to_use.append([parent_snapshot])
-            return snapshots_to_use
+        if len(self.children_output) == 0:
+            for snapshot_key in sorted(parent_table.positions):
+                sources_to_use.append([(parent_output, snapshot_key)])
+            return sources_to_use
 
         interval = self.get_min_max_of_interval()
 
         for snapshot_key in range(0, interval.minimum_start):
-            snapshots_to_use.append([parent_snapshots[snapshot_key]])
-
-        for parent_snapshot_key in range(interval.minimum_start, interval.maximum_end + 1):
-            nearest_snapshots_per_files = {}
-            for child_output in self.children_output:
-                closer_snapshots = child_output.get_nearest_snapshots(parent_snapshots[parent_snapshot_key])
-                if closer_snapshots is not None:
-                    nearest_snapshots_per_files[child_output.get_file_name()] = closer_snapshots
-            if len(nearest_snapshots_per_files) is not 0:
-                nearest_snapshots = self._find_nearest_snapshots(parent_snapshots[parent_snapshot_key],
-                                                                 nearest_snapshots_per_files)
-                snapshots_to_use.append(nearest_snapshots)
+            sources_to_use.append([(parent_output, snapshot_key)])
+
+        parent_keys = range(interval.minimum_start, interval.maximum_end + 1)
+        parent_timestamps = [parent_table.get_value("timestamp", key) for key in parent_keys]
+        nearest_ids_per_child = [child_output.get_nearest_snapshot_ids(parent_timestamps)
+                                 for child_output in self.children_output]
+
+        for index, parent_snapshot_key in enumerate(parent_keys):
+            nearest_sources_per_files = {}
+            for child_output, nearest_ids in zip(self.children_output, nearest_ids_per_child):
+                if nearest_ids[index] is not None:
+                    closer_ids = child_output.get_snapshot_ids_around(nearest_ids[index])
+                    nearest_sources_per_files[child_output.get_file_name()] = \
+                        [(child_output, snapshot_id) for snapshot_id in closer_ids]
+            if len(nearest_sources_per_files) != 0:
+                nearest_sources = self._find_nearest_snapshots((parent_output, parent_snapshot_key),
+                                                               nearest_sources_per_files)
+                sources_to_use.append(nearest_sources)
                 continue
-            snapshots_to_use.append([parent_snapshots[parent_snapshot_key]])
+            sources_to_use.append([(parent_output, parent_snapshot_key)])
 
         for snapshot_key in range(interval.maximum_end + 1, max_key + 1):
-            snapshots_to_use.append([parent_snapshots[snapshot_key]])
+            sources_to_use.append([(parent_output, snapshot_key)])
 
-        return snapshots_to_use
+        return sources_to_use
 
-    def _find_nearest_snapshots(self, parent_snapshot, nearest_snapshots_per_files):
+    def _find_nearest_snapshots(self, parent_source, nearest_sources_per_files):
         lists = []
-        lists.append([parent_snapshot])
-        for file_name in nearest_snapshots_per_files:
-            lists.append(nearest_snapshots_per_files[file_name])
-        permutations = list(itertools.product(*lists))
+        lists.append([parent_source])
+        for file_name in nearest_sources_per_files:
+            lists.append(nearest_sources_per_files[file_name])
+        timestamp_lists = [[output.get_table().get_value("timestamp", snapshot_id) for output, snapshot_id in sources]
+                           for sources in lists]
+        minimal_difference = self._get_minimal_window(timestamp_lists)
+
+        # Every combination spanning minimal_difference fits into a window starting at one of
+        # the timestamps. Trying the combinations in itertools.product order would pick the
+        # smallest index tuple among them, and within one window that is the first fitting
+        # snapshot of every list.
+        nearest_indexes = None
+        for start in sorted(set(itertools.chain(*timestamp_lists))):
+            end = start + minimal_difference
+            indexes = []
+            for timestamps in timestamp_lists:
+                for index, timestamp in enumerate(timestamps):
+                    if start <= timestamp <= end:
+                        indexes.append(index)
+                        break
+                else:
+                    break
+            if len(indexes) == len(timestamp_lists) and (nearest_indexes is None or indexes < nearest_indexes):
+                nearest_indexes = indexes
+        return tuple(sources[index] for sources, index in zip(lists, nearest_indexes))
 
+    def _get_minimal_window(self, timestamp_lists):
+        # Smallest time range containing at least one timestamp of every list.
+        events = sorted((timestamp, list_index) for list_index, timestamps in enumerate(timestamp_lists)
+                        for timestamp in timestamps)
+        counts = [0] * len(timestamp_lists)
+        covered_lists = 0
         minimal_difference = sys.maxint
-        nearest_snapshots = None
-        for permutation in permutations:
-            elapsed_time = self._check_difference_in_time(permutation)
-            if elapsed_time < minimal_difference:
-                minimal_difference = elapsed_time
-                nearest_snapshots = permutation
-        return nearest_snapshots
-
-    def _check_difference_in_time(self, permutation):
-        maximum_timestamp = 0
-        minimum_timestamp = sys.maxint
-        for snapshot in permutation:
-            if snapshot["timestamp"] < minimum_timestamp:
-                minimum_timestamp = snapshot["timestamp"]
-            if snapshot["timestamp"] > maximum_timestamp:
-                maximum_timestamp = snapshot["timestamp"]
-        elapsed_time = maximum_timestamp - minimum_timestamp
-        return elapsed_time
+        first = 0
+        for timestamp, list_index in events:
+            if counts[list_index] == 0:
+                covered_lists += 1
+            counts[list_index] += 1
+            while covered_lists == len(timestamp_lists):
+                first_timestamp, first_list_index = events[first]
+                if timestamp - first_timestamp < minimal_difference:
+                    minimal_difference = timestamp - first_timestamp
+                counts[first_list_index] -= 1
+                if counts[first_list_index] == 0:
+                    covered_lists -= 1
+                first += 1
+        return minimal_difference
 
     def get_min_max_of_interval(self):
+        if self.interval is not None:
+            return self.interval
         time_intervals = self.get_covered_time()
         minimum_start = sys.maxint
         maximum_end = 0
@@ -324,24 +1276,29 @@ class ResultGenerator(object):
             if time_intervals[file_interval][1] > maximum_end:
                 maximum_end = time_intervals[file_interval][1]
         TimeInterval = collections.namedtuple("TimeInterval", ["minimum_start", "maximum_end"])
-        time = TimeInterval(minimum_start, maximum_end)
-        return time
+        self.interval = TimeInterval(minimum_start, maximum_end)
+        return self.interval
 
     def get_covered_time(self):
+        if self.covered_time is not None:
+            return self.covered_time
         intervals_per_file = {}
+        parent_table = self.parent_output.get_table()
+        parent_timestamps = parent_table.columns["timestamp"]
         for output in self.children_output:
             minimum = None
             maximum = None
             start_end_time = output.get_start_end_time()
-            for (snapshot_key, snapshot) in sorted(self.parent_output.get_snapshots().items()):
-                if snapshot["timestamp"] >= start_end_time.start and minimum is None:
-                    minimum = snapshot_key
-                if snapshot["timestamp"] >= start_end_time.end and maximum is None:
-                    maximum = snapshot_key
-                    break
-            if maximum is None:
-                maximum = max(self.parent_output.get_snapshots())
+            position = bisect.bisect_left(parent_timestamps, start_end_time.start)
+            if position < len(parent_timestamps):
+                minimum = parent_table.ids[position]
+            position = bisect.bisect_left(parent_timestamps, start_end_time.end)
+            if position < len(parent_timestamps):
+                maximum = parent_table.ids[position]
+            else:
+                maximum = parent_table.get_max_id()
             intervals_per_file[output.get_file_name()] = (minimum, maximum)
+        self.covered_time = intervals_per_file
         return intervals_per_file
 
     def __str__(self):
@@ -359,25 +1316,203 @@ class ResultGenerator(object):
         return string
 
 
-def print_result_verbosity_1(chosen_snapshots):
+# Combined memory (mem_heap_B + mem_heap_extra_B) of all processes over time.
+# Every process is resampled onto a common time grid, a process counts
+# with 0 bytes outside of its first and last snapshot.
+class MemoryTimeline(object):
+    PERCENTILES = (50, 90, 95, 99)
+
+    def __init__(self, output_list, interpolation="step", step=None):
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("The memory timeline needs numpy!")
+        self.numpy = numpy
+        self.interpolation = interpolation
+        process_timestamps = []
+        process_memories = []
+        for output in output_list:
+            columns = output.get_table().columns
+            process_timestamps.append(numpy.frombuffer(columns["timestamp"], dtype="l"))
+            process_memories.append(numpy.frombuffer(columns["mem_heap_B"], dtype="l") +
+                                    numpy.frombuffer(columns["mem_heap_extra_B"], dtype="l"))
+        if step:
+            start = min(timestamps[0] for timestamps in process_timestamps)
+            end = max(timestamps[-1] for timestamps in process_timestamps)
+            self.grid = numpy.arange(start, end + 1, step, dtype="l")
+        else:
+            self.grid = numpy.unique(numpy.concatenate(process_timestamps))
+        self.memory = numpy.zeros(len(self.grid), dtype="float64")
+        for timestamps, memories in zip(process_timestamps, process_memories):
+            self.memory += self._resample(timestamps, memories)
+
+    def _resample(self, timestamps, memories):
+        numpy = self.numpy
+        if self.interpolation == "linear":
+            return numpy.interp(self.grid, timestamps, memories, left=0, right=0)
+        positions = numpy.searchsorted(timestamps, self.grid, side="right") - 1
+        alive = (positions >= 0) & (self.grid <= timestamps[-1])
+        return numpy.where(alive, memories[numpy.clip(positions, 0, None)], 0)
+
+    def get_grid(self):
+        return self.grid
+
+    def get_memory(self):
+        return self.memory
+
+    def get_metrics(self):
+        numpy = self.numpy
+        seconds = (self.grid - self.grid[0]) / 1000000.0
+        durations = numpy.diff(seconds)
+        if self.interpolation == "linear":
+            area = float(numpy.sum((self.memory[1:] + self.memory[:-1]) / 2 * durations))
+            weights = durations
+            values = (self.memory[1:] + self.memory[:-1]) / 2
+        else:
+            area = float(numpy.sum(self.memory[:-1] * durations))
+            weights = durations
+            values = self.memory[:-1]
+        peak_index = int(numpy.argmax(self.memory))
+        metrics = collections.OrderedDict()
+        metrics["points"] = len(self.grid)
+        metrics["peak_B"] = float(self.memory[peak_index])
+        metrics["peak_timestamp"] = int(self.grid[peak_index])
+        metrics["duration_s"] = float(seconds[-1])
+        metrics["average_B"] = area / seconds[-1] if seconds[-1] > 0 else metrics["peak_B"]
+        metrics["area_B_s"] = area
+        order = numpy.argsort(values, kind="mergesort")
+        cumulative_weights = numpy.cumsum(weights[order])
+        for percentile in self.PERCENTILES:
+            if len(values) == 0 or cumulative_weights[-1] <= 0:
+                metrics["p%d_B" % percentile] = metrics["peak_B"]
+                continue
+            index = numpy.searchsorted(cumulative_weights, cumulative_weights[-1] * percentile / 100.0)
+            metrics["p%d_B" % percentile] = float(values[order[min(index, len(order) - 1)]])
+        return metrics
+
+
+def collect_allocation_sites(chosen_sources, names):
+    # Bytes and pids per interned function, summed over the heap trees of the
+    # chosen snapshots (or the nearest detailed ones) of every process.
+    sites = {}
+    tree_sources = []
+    for output, snapshot_id in chosen_sources:
+        detailed_id = output.get_detailed_snapshot_id(snapshot_id)
+        if detailed_id is None:
+            continue
+        tree = output.get_heap_tree(detailed_id, names)
+        if tree is None:
+            continue
+        tree_sources.append((output, detailed_id))
+        for function, size in tree.get_allocation_sites():
+            site = sites.setdefault(function, [0, set()])
+            site[0] += size
+            site[1].add(output.get_pid())
+    return sites, tree_sources
+
+
+def get_top_allocation_sites(sites, names, top):
+    largest = heapq.nlargest(top, sites.items(), key=lambda item: (item[1][0], -item[0]))
+    return [AllocationSite(names.get_name(function), size, sorted(pid for pid in pids if pid is not None))
+            for function, (size, pids) in largest]
+
+
+def format_allocation_sites(allocation_sites, tree_sources):
+    string = "Top allocation sites (heap trees of %s):\n" \
+             % ", ".join("%s:%d" % (output.get_file_name(), snapshot_id) for output, snapshot_id in tree_sources)
+    for site in allocation_sites:
+        string += " %d %.2f %s [%s]\n" % (site.bytes, float(site.bytes) / TO_MEGA, site.function,
+                                         ",".join(str(pid) for pid in site.pids))
+    return string + "\n"
+
+
+def get_mean(values):
+    return float(sum(values)) / len(values) if values else 0.0
+
+
+def average_allocation_sites(run_sites, names):
+    # Mean bytes per interned function over the runs, a run without the function counts with 0.
+    totals = collections.defaultdict(int)
+    for sites in run_sites:
+        for name, size in sites.items():
+            totals[names.intern(name)] += size
+    return dict((function, float(size) / len(run_sites)) for function, size in totals.items())
+
+
+def diff_allocation_sites(baseline, candidate, names, top):
+    # The top sites that grew and shrank most from the baseline to the candidate means.
+    changes = []
+    for function in set(baseline) | set(candidate):
+        baseline_bytes = baseline.get(function, 0.0)
+        candidate_bytes = candidate.get(function, 0.0)
+        changes.append(AllocationDiff(names.get_name(function), baseline_bytes, candidate_bytes,
+                                      candidate_bytes - baseline_bytes))
+    grew = heapq.nlargest(top, (change for change in changes if change.change > 0),
+                          key=lambda change: (change.change, change.function))
+    shrank = heapq.nsmallest(top, (change for change in changes if change.change < 0),
+                             key=lambda change: (change.change, change.function))
+    return grew, shrank
+
+
+def format_allocation_diff(sets, grew, shrank):
+    string = ""
+    for label, (path, peaks, failed_runs) in sets:
+        string += "%s: %s, %d runs (%d failed), mean peak %d B (%.2f MiB)\n" \
+                  % (label, path, len(peaks), failed_runs, get_mean(peaks), get_mean(peaks) / TO_MEGA)
+    for title, changes in (("Grew most", grew), ("Shrank most", shrank)):
+        string += "\n%s:\n" % title
+        for change in changes:
+            string += " %+d %+.2f %s (%.2f -> %.2f MiB)\n" \
+                      % (change.change, change.change / TO_MEGA, change.function,
+                         change.baseline_bytes / TO_MEGA, change.candidate_bytes / TO_MEGA)
+    return string + "\n"
+
+
+def format_memory(maximum_memory):
+    return "%d %.2f %.2f\n\n" % (maximum_memory, float(maximum_memory)/TO_KILO, float(maximum_memory)/TO_MEGA)
+
+
+def format_result_verbosity_1(chosen_snapshots):
     maximum_memory = 0
     for snapshot in chosen_snapshots:
         maximum_memory += snapshot["mem_heap_B"]
-    print("%d %.2f %.2f\n" % (maximum_memory, float(maximum_memory)/TO_KILO, float(maximum_memory)/TO_MEGA))
+    return format_memory(maximum_memory)
 
 
-def print_result_verbosity_2(chosen_snapshots, output_list):
-    print_result_verbosity_1(chosen_snapshots)
-    for snapshot in chosen_snapshots:
-        for output in output_list:
-            if snapshot in output:
-                snapshot_id = output.get_snapshot_id(snapshot)
-                print("%s:\n"
-                      " snapshot_id = %d\n"
-                      " timestamp = %d\n"
-                      " mem_heap_B = %d\n"
-                      % (output.get_file_name(), snapshot_id, snapshot["timestamp"], snapshot["mem_heap_B"]))
-                continue
+def print_result_verbosity_1(chosen_snapshots):
+    sys.stdout.write(format_result_verbosity_1(chosen_snapshots))
+
+
+def format_result_verbosity_2(chosen_snapshots, output_list, chosen_sources=None):
+    string = format_result_verbosity_1(chosen_snapshots)
+    if chosen_sources is None:
+        chosen_sources = []
+        for snapshot in chosen_snapshots:
+            for output in output_list:
+                if snapshot in output:
+                    chosen_sources.append((output, output.get_snapshot_id(snapshot)))
+    for output, snapshot_id in chosen_sources:
+        snapshot = output.get_snapshots()[snapshot_id]
+        string += "%s:\n" \
+                  " snapshot_id = %d\n" \
+                  " timestamp = %d\n" \
+                  " mem_heap_B = %d\n\n" \
+                  % (output.get_file_name(), snapshot_id, snapshot["timestamp"], snapshot["mem_heap_B"])
+    return string
+
+
+def format_timeline(timeline):
+    string = "Timeline (%s interpolation):\n" % timeline.interpolation
+    for key, value in timeline.get_metrics().items():
+        if isinstance(value, float):
+            string += " %s = %.2f\n" % (key, value)
+        else:
+            string += " %s = %d\n" % (key, value)
+    return string + "\n"
+
+
+def print_result_verbosity_2(chosen_snapshots, output_list, chosen_sources=None):
+    sys.stdout.write(format_result_verbosity_2(chosen_snapshots, output_list, chosen_sources))
 
 
 def validate_output_files(output_list):
@@ -398,29 +1533,670 @@ def validate_output_files(output_list):
         raise IOError("The log files are not from one measurement!")
 
 
-def main():
-    if not len(sys.argv) > 1:
-        sys.stderr.write("No log files were provided!\n")
-        exit(1)
+def print_parse_stats(output_list):
+    for output in output_list:
+        if output.is_from_cache():
+            sys.stderr.write("Loaded %s: %d snapshots from the cache in %.3f s\n"
+                             % (output.get_file_name(), len(output.get_table()), output.get_parse_time()))
+            continue
+        sys.stderr.write("Parsed %s: %d snapshots, %.2f MiB in %.3f s (%.2f MiB/s)\n"
+                         % (output.get_file_name(), len(output.get_table()),
+                            float(output.get_parsed_bytes()) / TO_MEGA, output.get_parse_time(),
+                            output.get_parse_throughput()))
+
+
+def format_error(err):
+    if isinstance(err, IOError):
+        return "ERROR with the files: %s" % str(err)
+    if isinstance(err, RuntimeError):
+        return "RuntimeError: %s" % str(err)
+    return "ERROR: %s" % str(err)
+
+
+def get_batch_runs(site_dir):
+    # Groups the "<run>-.out<pid>" files of a site directory or archive by run number.
+    files_per_run = {}
+    if os.path.isfile(site_dir) and site_dir.endswith(ARCHIVE_EXTENSIONS):
+        file_names = list_archive(site_dir)
+    else:
+        file_names = os.listdir(site_dir)
+    for file_name in file_names:
+        match = re.match("^(\d+)-\.out\d+", os.path.basename(file_name))
+        if match:
+            files_per_run.setdefault(int(match.group(1)), []).append(os.path.join(site_dir, file_name))
+    return [(run, sorted(files_per_run[run])) for run in sorted(files_per_run)]
+
+
+def get_run_number(file_names):
+    for file_name in file_names:
+        match = re.match("^(\\d+)-", os.path.basename(file_name))
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def build_result_record(result_generator, run=None, timeline=None, allocation_sites=None):
+    record = collections.OrderedDict()
+    record["run"] = run
+    record["peak_B"] = result_generator.get_useful_memory()
+    record["peak_extra_B"] = result_generator.get_extra_memory()
+    record["coverage_percent"] = result_generator.get_found_nearest_snapshots_percentage()
+    record["parent_pid"] = result_generator.get_parent_output().get_pid()
+    record["child_pids"] = [output.get_pid() for output in result_generator.get_children_output()]
+    record["processes"] = []
+    for output, snapshot_id in result_generator.get_chosen_sources():
+        snapshot = output.get_snapshots()[snapshot_id]
+        process = collections.OrderedDict()
+        process["file"] = output.get_file_name()
+        process["pid"] = output.get_pid()
+        process["snapshot_id"] = snapshot_id
+        for key in SNAPSHOT_COLUMNS:
+            process[key] = snapshot[key]
+        record["processes"].append(process)
+    if timeline is not None:
+        record["timeline"] = timeline.get_metrics()
+    if allocation_sites is not None:
+        record["allocation_sites"] = [site._asdict() for site in allocation_sites]
+    return record
+
 
+def format_csv_header():
+    return ",".join(CSV_FIELDS) + "\n"
+
+
+def format_result_record(record, output_format):
+    if output_format == "json":
+        return json.dumps(record) + "\n"
+    values = []
+    for field in CSV_FIELDS:
+        value = record.get(field)
+        if field == "child_pids":
+            value = ";".join(str(pid) for pid in value)
+        elif field == "processes":
+            value = ";".join("%s:%d:%d:%d" % (process["pid"], process["snapshot_id"], process["mem_heap_B"],
+                                              process["mem_heap_extra_B"]) for process in value)
+        elif field == "error" and value is not None:
+            value = '"%s"' % value.replace('"', '""').replace("\n", " ")
+        values.append("" if value is None else str(value))
+    return ",".join(values) + "\n"
+
+
+def format_error_record(run, error, output_format):
+    if output_format == "text":
+        # The same line as measure.sh writes for a failed run.
+        return "Error occurred in measure number: %d Error: %s\n" % (run, error.replace("\n", " "))
+    record = collections.OrderedDict()
+    record["run"] = run
+    record["error"] = error
+    if output_format == "csv":
+        record["child_pids"] = []
+        record["processes"] = []
+    return format_result_record(record, output_format)
+
+
+# (class name or None for the module functions, function name) of the
+# functions timed by --profile.
+PROFILED_FUNCTIONS = (
+    ("MassifOutput", "_parse_snapshots"),
+    ("ResultGenerator", "get_covered_time"),
+    ("ResultGenerator", "_get_sources_to_use"),
+    ("ResultGenerator", "_find_nearest_snapshots"),
+    ("ResultGenerator", "_get_position_matrix"),
+    ("ResultGenerator", "_calculate_percentage"),
+    ("ResultGenerator", "_get_snapshots_with_max_memory"),
+    ("MemoryTimeline", "__init__"),
+    (None, "collect_allocation_sites"),
+    (None, "format_result_verbosity_2"),
+    (None, "build_result_record"),
+    (None, "format_result_record"),
+)
+PROFILER = None
+
+
+# Wall time, call count and peak memory of every profiled function, and the
+# size of every analysed log file. The timing wrappers are only installed by
+# install(), the analysis runs the plain functions without --profile. Nested
+# functions are counted in their callers too. The peak is the traced Python
+# memory with tracemalloc, without it (Python 2) the growth of the maximum RSS.
+class PhaseProfiler(object):
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = collections.OrderedDict()
+        self.files = []
+        self.memory_stack = []
+        self.tracemalloc = None
+        if trace_memory:
+            try:
+                import tracemalloc
+                self.tracemalloc = tracemalloc
+                tracemalloc.start()
+            except ImportError:
+                import resource
+                self.resource = resource
+
+    def install(self):
+        for class_name, function_name in PROFILED_FUNCTIONS:
+            owner = globals()[class_name] if class_name else None
+            phase = "%s.%s" % (class_name, function_name) if class_name else function_name
+            self.phases[phase] = [0, 0.0, 0]
+            if owner is None:
+                globals()[function_name] = self._wrap(phase, globals()[function_name])
+            else:
+                setattr(owner, function_name, self._wrap(phase, owner.__dict__[function_name]))
+
+    def _wrap(self, phase, function):
+        def profiled(*args, **kwargs):
+            self._enter()
+            started = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._leave(phase, time.time() - started)
+        profiled.__name__ = function.__name__
+        return profiled
+
+    def _get_traced_memory(self):
+        if self.tracemalloc is not None:
+            return self.tracemalloc.get_traced_memory()
+        # ru_maxrss is in KiB on Linux.
+        max_rss = self.resource.getrusage(self.resource.RUSAGE_SELF).ru_maxrss * TO_KILO
+        return max_rss, max_rss
+
+    def _enter(self):
+        if not self.trace_memory:
+            return
+        current, peak = self._get_traced_memory()
+        if self.memory_stack:
+            self.memory_stack[-1][1] = max(self.memory_stack[-1][1], peak)
+        self.memory_stack.append([current, 0])
+        if self.tracemalloc is not None and hasattr(self.tracemalloc, "reset_peak"):
+            self.tracemalloc.reset_peak()
+
+    def _leave(self, phase, elapsed):
+        stats = self.phases[phase]
+        stats[0] += 1
+        stats[1] += elapsed
+        if not self.trace_memory:
+            return
+        start, inner_peak = self.memory_stack.pop()
+        peak = max(self._get_traced_memory()[1], inner_peak)
+        stats[2] = max(stats[2], peak - start)
+        if self.memory_stack:
+            self.memory_stack[-1][1] = max(self.memory_stack[-1][1], peak)
+
+    def add_files(self, output_list, result_generator=None):
+        matched = collections.Counter()
+        if result_generator is not None:
+            for source_vector in result_generator.sources_to_use:
+                matched.update(output.get_file_name() for output, snapshot_id in source_vector)
+        for output in output_list:
+            self.files.append((output.get_file_name(), len(output.get_table()), output.get_parsed_bytes(),
+                               output.is_from_cache(), matched[output.get_file_name()]))
+
+    def pop_stats(self):
+        stats = (dict((phase, list(values)) for phase, values in self.phases.items()), self.files)
+        for values in self.phases.values():
+            values[:] = [0, 0.0, 0]
+        self.files = []
+        return stats
+
+    def merge_stats(self, stats):
+        phases, files = stats
+        for phase, (calls, elapsed, peak) in phases.items():
+            values = self.phases[phase]
+            values[0] += calls
+            values[1] += elapsed
+            values[2] = max(values[2], peak)
+        self.files.extend(files)
+
+    def format(self):
+        string = "Phase profile (inclusive wall time):\n"
+        for phase, (calls, elapsed, peak) in self.phases.items():
+            if not calls:
+                continue
+            string += " %-46s %8d calls %10.3f s" % (phase, calls, elapsed)
+            if self.trace_memory:
+                string += " %10.2f MiB %s" % (float(peak) / TO_MEGA,
+                                              "peak" if self.tracemalloc is not None else "max RSS growth")
+            string += "\n"
+        string += "Files (snapshots, parsed bytes, vectors in which the file is used):\n"
+        for file_name, snapshots, parsed_bytes, from_cache, matched in self.files:
+            string += " %s: %d snapshots, %s, %d vectors\n" \
+                      % (file_name, snapshots, "from the cache" if from_cache else "%d bytes" % parsed_bytes, matched)
+        return string
+
+    def dump_memory(self, file_name):
+        if self.tracemalloc is not None:
+            self.tracemalloc.take_snapshot().dump(file_name)
+
+
+def analyse_measurement(file_names, arguments):
+    cache = None
+    if arguments.cache_dir:
+        cache = SnapshotCache(arguments.cache_dir, arguments.cache_size * TO_MEGA)
     output_list = []
+    for file_name in file_names:
+        output_list.append(MassifOutput(file_name, cache))
+    if arguments.parse_stats:
+        print_parse_stats(output_list)
+    validate_output_files(output_list)
+    result_generator = ResultGenerator(output_list)
+    if PROFILER is not None:
+        PROFILER.add_files(output_list, result_generator)
+    timeline = None
+    if arguments.timeline:
+        timeline = MemoryTimeline(output_list, arguments.timeline, arguments.timeline_step)
+    allocation_sites = None
+    if arguments.top_sites:
+        names = NameTable()
+        sites, tree_sources = collect_allocation_sites(result_generator.get_chosen_sources(), names)
+        allocation_sites = get_top_allocation_sites(sites, names, arguments.top_sites)
+    if arguments.format != "text":
+        record = build_result_record(result_generator, get_run_number(file_names), timeline, allocation_sites)
+        return format_result_record(record, arguments.format)
+    string = format_result_verbosity_2(result_generator.get_chosen_snapshots(), output_list,
+                                       result_generator.get_chosen_sources())
+    if timeline is not None:
+        string += format_timeline(timeline)
+    if allocation_sites is not None:
+        string += format_allocation_sites(allocation_sites, tree_sources)
+    return string
+
+
+def analyse_batch_run(job):
+    file_names, arguments = job
+    try:
+        result = analyse_measurement(file_names, arguments), None
+    except Exception as err:
+        result = None, format_error(err)
+    if PROFILER is not None:
+        # The stats of the pool workers are merged in the main process.
+        return result + (PROFILER.pop_stats(),)
+    return result + (None,)
+
+
+def run_batch(site_dirs, jobs, write_results, arguments):
+    runs = []
+    for site_dir in site_dirs:
+        for run, file_names in get_batch_runs(site_dir):
+            runs.append((site_dir, run, file_names))
+    batch_jobs = [(file_names, arguments) for site_dir, run, file_names in runs]
+
+    pool = None
+    if jobs > 1 and len(batch_jobs) > 1 and not arguments.profile_dump:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(analyse_batch_run, batch_jobs)
+    else:
+        results = (analyse_batch_run(job) for job in batch_jobs)
+
+    failed_runs = 0
+    result_files = {}
+    for (site_dir, run, file_names), (output, error, profile_stats) in zip(runs, results):
+        if profile_stats is not None:
+            PROFILER.merge_stats(profile_stats)
+        destination = None
+        if write_results:
+            destination = site_dir.rstrip(os.sep)
+            for extension in ARCHIVE_EXTENSIONS:
+                if destination.endswith(extension):
+                    destination = destination[:-len(extension)]
+                    break
+        if destination not in result_files:
+            if destination is None:
+                result_files[destination] = sys.stdout
+                write_header = True
+            else:
+                # measure.sh appends the results of every run to the same file.
+                result_file_name = destination + RESULT_FILE_EXTENSIONS[arguments.format]
+                write_header = arguments.overwrite or not os.path.exists(result_file_name) \
+                    or os.path.getsize(result_file_name) == 0
+                result_files[destination] = open(result_file_name, "w" if arguments.overwrite else "a")
+            if arguments.format == "csv" and write_header:
+                result_files[destination].write(format_csv_header())
+        if error is not None:
+            failed_runs += 1
+            sys.stderr.write("Run %d of %s failed: %s\n" % (run, site_dir, error))
+            result_files[destination].write(format_error_record(run, error, arguments.format))
+            continue
+        result_files[destination].write(output)
+    for destination, result_file in result_files.items():
+        if destination is not None:
+            result_file.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return failed_runs
+
+
+def read_result_peak(file_name, output_format):
+    # Peak of one run from its result file, None if the run failed.
+    with open(file_name, "r") as result_file:
+        lines = [line for line in result_file if line.strip()]
+    if output_format == "csv":
+        lines = [line for line in lines if not line.startswith("run,")]
+    if not lines or "Error" in lines[0] or "ERROR" in lines[0]:
+        return None
+    if output_format == "json":
+        return json.loads(lines[0]).get("peak_B")
+    if output_format == "csv":
+        peak = lines[0].split(",")[CSV_FIELDS.index("peak_B")]
+        return int(peak) if peak else None
+    return int(lines[0].split()[0])
+
+
+def get_confidence_interval(peaks):
+    # Mean and half width of the 95% confidence interval of the mean.
+    mean = float(sum(peaks)) / len(peaks)
+    if len(peaks) < 2:
+        return mean, float("inf")
+    variance = sum((peak - mean) ** 2 for peak in peaks) / (len(peaks) - 1)
+    quantile = NORMAL_QUANTILE_95
+    if len(peaks) - 1 <= len(T_QUANTILES_95):
+        quantile = T_QUANTILES_95[len(peaks) - 2]
+    return mean, quantile * (variance / len(peaks)) ** 0.5
+
+
+def check_stability(result_files, output_format, min_runs, max_runs, tolerance):
+    # Prints "stop" once the interval of the successful runs is narrower than
+    # tolerance percent of the mean after min_runs, or max_runs were measured.
+    peaks = []
+    for file_name in result_files:
+        peak = read_result_peak(file_name, output_format)
+        if peak is not None:
+            peaks.append(peak)
+    decision = "continue"
+    mean, half_width = 0.0, float("inf")
+    if peaks:
+        mean, half_width = get_confidence_interval(peaks)
+    relative_width = half_width / mean * 100 if mean else (0.0 if half_width == 0 else float("inf"))
+    if len(result_files) >= max_runs or (len(peaks) >= min_runs and relative_width <= tolerance):
+        decision = "stop"
+    sys.stdout.write("%s %d %d %.2f %.3f\n" % (decision, len(result_files), len(peaks), mean, relative_width))
+    return 0
+
+
+def get_diff_runs(path):
+    # Every run of a site directory or archive, or the one run of a prefix like site/1-.
+    if os.path.isdir(path) or (os.path.isfile(path) and path.endswith(ARCHIVE_EXTENSIONS)):
+        return get_batch_runs(path)
+    archive, member = split_archive_path(path)
+    if archive is not None:
+        file_names = [os.path.join(archive, file_name) for file_name in list_archive(archive)
+                      if file_name.startswith(member)]
+    else:
+        directory, prefix = os.path.split(path)
+        file_names = [os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory or "."))
+                      if file_name.startswith(prefix)]
+    if not file_names:
+        raise IOError("There are no massif files starting with \"%s\"!" % path)
+    return [(get_run_number(file_names), file_names)]
+
+
+def collect_run_allocation_sites(job):
+    # Peak and bytes per function name of the allocation sites at the peak of one run.
+    file_names, arguments = job
     try:
-        for i in range(1, len(sys.argv)):
-            file_name = sys.argv[i]
-            output_list.append(MassifOutput(file_name))
+        cache = None
+        if arguments.cache_dir:
+            cache = SnapshotCache(arguments.cache_dir, arguments.cache_size * TO_MEGA)
+        output_list = [MassifOutput(file_name, cache) for file_name in file_names]
         validate_output_files(output_list)
         result_generator = ResultGenerator(output_list)
-        chosen_snapshots = result_generator.get_chosen_snapshots()
-        print_result_verbosity_2(chosen_snapshots, output_list)
-    except IOError as err:
-        sys.stderr.write("ERROR with the files: %s\n" % str(err))
-        exit(1)
-    except RuntimeError as err:
-        sys.stderr.write("RuntimeError: %s\n" % str(err))
+        names = NameTable()
+        sites, tree_sources = collect_allocation_sites(result_generator.get_chosen_sources(), names)
+        for output in output_list:
+            output.close()
+        if not tree_sources:
+            raise IOError("The processes have no detailed snapshots!")
+        return result_generator.get_useful_memory(), \
+            dict((names.get_name(function), size) for function, (size, pids) in sites.items()), None
+    except Exception as err:
+        return None, None, format_error(err)
+
+
+def run_diff(baseline_path, candidate_path, jobs, arguments):
+    runs = [(label, path, file_names) for label, path in (("baseline", baseline_path), ("candidate", candidate_path))
+            for run, file_names in get_diff_runs(path)]
+    diff_jobs = [(file_names, arguments) for label, path, file_names in runs]
+    pool = None
+    if jobs > 1 and len(diff_jobs) > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(collect_run_allocation_sites, diff_jobs)
+    else:
+        results = (collect_run_allocation_sites(job) for job in diff_jobs)
+
+    # The names are interned once more here, so the functions of both sets share their indexes.
+    names = NameTable()
+    peaks = {"baseline": [], "candidate": []}
+    run_sites = {"baseline": [], "candidate": []}
+    failed_runs = {"baseline": 0, "candidate": 0}
+    for (label, path, file_names), (peak, sites, error) in zip(runs, results):
+        if error is not None:
+            failed_runs[label] += 1
+            sys.stderr.write("Run %s of %s failed: %s\n" % (get_run_number(file_names), path, error))
+            continue
+        peaks[label].append(peak)
+        run_sites[label].append(sites)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if not run_sites["baseline"] or not run_sites["candidate"]:
+        raise IOError("No run of the baseline or the candidate could be analysed!")
+
+    top = arguments.top_sites or DEFAULT_DIFF_SITES
+    grew, shrank = diff_allocation_sites(average_allocation_sites(run_sites["baseline"], names),
+                                         average_allocation_sites(run_sites["candidate"], names), names, top)
+    sets = [(label, (path, peaks[label], failed_runs[label]))
+            for label, path in (("baseline", baseline_path), ("candidate", candidate_path))]
+    if arguments.format == "json":
+        record = collections.OrderedDict()
+        for label, (path, set_peaks, set_failed_runs) in sets:
+            record[label] = collections.OrderedDict([("path", path), ("runs", len(set_peaks)),
+                                                     ("failed_runs", set_failed_runs),
+                                                     ("mean_peak_B", get_mean(set_peaks))])
+        record["grew"] = [change._asdict() for change in grew]
+        record["shrank"] = [change._asdict() for change in shrank]
+        return json.dumps(record) + "\n"
+    if arguments.format == "csv":
+        string = "function,baseline_B,candidate_B,change_B\n"
+        for change in grew + shrank:
+            string += '"%s",%.1f,%.1f,%.1f\n' % (change.function.replace('"', '""'), change.baseline_bytes,
+                                                 change.candidate_bytes, change.change)
+        return string
+    return format_allocation_diff(sets, grew, shrank)
+
+
+def is_process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def run_follow(prefix, window, interval, idle_timeout, ceiling, pid):
+    tracker = PeakTracker(prefix, window, ceiling)
+    last_data_time = time.time()
+    reported_peak = None
+    while True:
+        if tracker.poll() > 0:
+            last_data_time = time.time()
+        if tracker.get_peak_heap() != reported_peak:
+            reported_peak = tracker.get_peak_heap()
+            sys.stderr.write("Peak so far: %d bytes (%.2f MiB) at %s in %d process(es)\n"
+                             % (reported_peak, float(reported_peak) / TO_MEGA, tracker.get_peak_timestamp(),
+                                tracker.get_peak_processes()))
+        if tracker.is_ceiling_crossed():
+            sys.stderr.write("The memory ceiling of %d bytes is crossed!\n" % ceiling)
+            if pid is not None and is_process_running(pid):
+                os.kill(pid, signal.SIGTERM)
+            break
+        if pid is not None:
+            if not is_process_running(pid):
+                break
+        elif time.time() - last_data_time > idle_timeout:
+            break
+        time.sleep(interval)
+    if not tracker.is_ceiling_crossed():
+        tracker.finish()
+    sys.stdout.write(format_memory(tracker.get_peak_heap()))
+    if tracker.is_ceiling_crossed():
+        return 2
+    return 0
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Finds the peak memory consumption of a measurement "
+                                                 "from the massif log files of its processes.")
+    parser.add_argument("log_files", nargs="*",
+                        help="massif output files of one measurement, also gzip/xz/zstd compressed or inside a "
+                             "tar archive (site.tar/1-.out123.gz), or site directories or archives with --batch")
+    parser.add_argument("--batch", action="store_true",
+                        help="analyse every run of the given site directories or site.tar archives")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of runs analysed in parallel in batch mode (default: %(default)s)")
+    parser.add_argument("-w", "--write-results", action="store_true",
+                        help="append the results of every site directory to <site>.txt "
+                             "(<site>.jsonl or <site>.csv with --format) in batch mode")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="replace the result files written by --write-results instead of appending")
+    parser.add_argument("--format", choices=["text", "json", "csv"], default="text",
+                        help="text report, or one JSON line / CSV row per run (default: %(default)s)")
+    parser.add_argument("--parse-stats", action="store_true",
+                        help="report the parse throughput of every log file on stderr")
+    parser.add_argument("--cache-dir", default=os.environ.get("MASSIF_CACHE_DIR"),
+                        help="keep the parsed log files in this directory "
+                             "(default: $MASSIF_CACHE_DIR, no caching if unset)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // TO_MEGA,
+                        help="size limit of the cache directory in MiB (default: %(default)s)")
+    parser.add_argument("--timeline", choices=["step", "linear"],
+                        help="also resample every process onto a common time grid with step or linear "
+                             "interpolation and report statistics of the summed timeline (needs numpy)")
+    parser.add_argument("--timeline-step", type=int, metavar="MICROSECONDS",
+                        help="use an evenly spaced grid instead of the union of the snapshot timestamps")
+    parser.add_argument("--top-sites", type=int, default=0, metavar="N",
+                        help="also report the N allocation sites using the most memory at the peak, from the "
+                             "heap trees of the chosen or the nearest detailed snapshots (JSON: allocation_sites)")
+    parser.add_argument("--diff", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="compare the allocation sites at the peak of two run sets, each a site directory or "
+                             "archive (every run) or a run prefix like site/1-, averaged over the runs; reports the "
+                             "--top-sites (default: %d) sites that grew and shrank most" % DEFAULT_DIFF_SITES)
+    parser.add_argument("--follow", metavar="PREFIX",
+                        help="follow the massif files starting with PREFIX (e.g. site/1-.out) while they are "
+                             "written and report the running peak; exits with 2 if the ceiling is crossed")
+    parser.add_argument("--window", type=int, default=64,
+                        help="snapshots kept per process when following (default: %(default)s)")
+    parser.add_argument("--poll-interval", type=float, default=0.5,
+                        help="seconds between two reads of the followed files (default: %(default)s)")
+    parser.add_argument("--idle-timeout", type=float, default=10,
+                        help="stop following after this many seconds without new data, "
+                             "unless --pid is given (default: %(default)s)")
+    parser.add_argument("--pid", type=int,
+                        help="stop following when this process exits, terminate it if the ceiling is crossed")
+    parser.add_argument("--ceiling", type=int, metavar="BYTES",
+                        help="stop following once the combined mem_heap_B exceeds BYTES")
+    parser.add_argument("--stability", action="store_true",
+                        help="read the result files of the runs of one site and print whether to stop measuring: "
+                             "\"stop|continue runs successful_runs mean_B half_width_percent\"")
+    parser.add_argument("--min-runs", type=int, default=3,
+                        help="successful runs needed before stopping with --stability (default: %(default)s)")
+    parser.add_argument("--max-runs", type=int, default=10,
+                        help="stop after this many runs with --stability, even if unstable (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=1.0, metavar="PERCENT",
+                        help="stop when the 95%% confidence interval of the mean peak is within this percent "
+                             "of the mean with --stability (default: %(default)s)")
+    parser.add_argument("--profile", action="store_true",
+                        help="report the wall time and call count of the analysis phases and the size of every log "
+                             "file on stderr (or into --profile-output)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also report the peak traced Python memory of every phase (slow), or the growth of "
+                             "the maximum RSS without tracemalloc")
+    parser.add_argument("--profile-output", metavar="FILE", help="write the profile into FILE instead of stderr")
+    parser.add_argument("--profile-dump", metavar="PREFIX",
+                        help="write cProfile statistics into PREFIX.pstats and, with --profile-memory, a tracemalloc "
+                             "snapshot into PREFIX.tracemalloc (batch runs are then analysed in this process)")
+    arguments = parser.parse_args()
+    if arguments.profile_output and not (arguments.profile or arguments.profile_memory or arguments.profile_dump):
+        parser.error("--profile-output needs --profile, --profile-memory or --profile-dump")
+    # The profile covers the analysis of log files and batch runs only.
+    if arguments.profile or arguments.profile_memory or arguments.profile_output or arguments.profile_dump:
+        for option, value in (("--follow", arguments.follow), ("--diff", arguments.diff),
+                              ("--stability", arguments.stability)):
+            if value:
+                parser.error("the profile options cannot be used with %s" % option)
+    return arguments
+
+
+def write_profile(arguments, profile):
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(arguments.profile_dump + ".pstats")
+        PROFILER.dump_memory(arguments.profile_dump + ".tracemalloc")
+    if arguments.profile_output:
+        with open(arguments.profile_output, "w") as profile_file:
+            profile_file.write(PROFILER.format())
+    else:
+        sys.stderr.write(PROFILER.format())
+
+
+def main():
+    global PROFILER
+    arguments = parse_arguments()
+    if arguments.follow:
+        try:
+            exit(run_follow(arguments.follow, arguments.window, arguments.poll_interval, arguments.idle_timeout,
+                            arguments.ceiling, arguments.pid))
+        except Exception as err:
+            sys.stderr.write(format_error(err) + "\n")
+            exit(1)
+
+    if arguments.diff:
+        try:
+            sys.stdout.write(run_diff(arguments.diff[0], arguments.diff[1], arguments.jobs, arguments))
+        except Exception as err:
+            sys.stderr.write(format_error(err) + "\n")
+            exit(1)
+        return
+
+    if not len(arguments.log_files) > 0:
+        sys.stderr.write("No log files were provided!\n")
         exit(1)
+
+    if arguments.stability:
+        try:
+            exit(check_stability(arguments.log_files, arguments.format, arguments.min_runs, arguments.max_runs,
+                                 arguments.tolerance))
+        except Exception as err:
+            sys.stderr.write(format_error(err) + "\n")
+            exit(1)
+
+    profile = None
+    if arguments.profile or arguments.profile_memory or arguments.profile_dump:
+        PROFILER = PhaseProfiler(arguments.profile_memory)
+        PROFILER.install()
+        if arguments.profile_dump:
+            profile = cProfile.Profile()
+            profile.enable()
+
+    if arguments.batch:
+        failed_runs = run_batch(arguments.log_files, arguments.jobs, arguments.write_results, arguments)
+        if PROFILER is not None:
+            write_profile(arguments, profile)
+        if failed_runs > 0:
+            exit(1)
+        return
+
+    try:
+        result = analyse_measurement(arguments.log_files, arguments)
+        if arguments.format == "csv":
+            sys.stdout.write(format_csv_header())
+        sys.stdout.write(result)
     except Exception as err:
-        sys.stderr.write("ERROR: %s\n" % str(err))
+        sys.stderr.write(format_error(err) + "\n")
         exit(1)
+    finally:
+        if PROFILER is not None:
+            write_profile(arguments, profile)
 
 
 if __name__ == "__main__":
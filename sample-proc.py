@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+TO_KILO = 1024
+METRICS = ("rss", "pss", "anon")
+DEFAULT_OUT_FILE = "sample.out%p"
+
+
+def read_status(pid):
+    # VmRSS and RssAnon of a process in bytes, None if it is gone or a zombie.
+    memory = {}
+    try:
+        with open("/proc/%d/status" % pid, "r") as status_file:
+            for line in status_file:
+                if line.startswith(("VmRSS:", "RssAnon:")):
+                    memory[line.split(":")[0]] = int(line.split()[1]) * TO_KILO
+    except (IOError, OSError):
+        return None
+    if "VmRSS" not in memory:
+        return None
+    return memory["VmRSS"], memory.get("RssAnon", memory["VmRSS"])
+
+
+def read_pss(pid):
+    # smaps_rollup needs Linux 4.14, None if it cannot be read.
+    try:
+        with open("/proc/%d/smaps_rollup" % pid, "r") as rollup_file:
+            for line in rollup_file:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * TO_KILO
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def get_children_from_task_lists(pid):
+    children = []
+    for task in os.listdir("/proc/%d/task" % pid):
+        with open("/proc/%d/task/%s/children" % (pid, task), "r") as children_file:
+            children.extend(int(child) for child in children_file.read().split())
+    return children
+
+
+def get_children_from_stat(pid):
+    # Fallback for kernels without CONFIG_PROC_CHILDREN, scans every process.
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry, "r") as stat_file:
+                stat = stat_file.read()
+        except (IOError, OSError):
+            continue
+        # The command name in parentheses may contain spaces.
+        if int(stat[stat.rfind(")") + 2:].split()[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+class ProcessTreeSampler(object):
+    def __init__(self, root_pid, out_file, metric, description, command):
+        self.root_pid = root_pid
+        self.out_file = out_file
+        self.metric = metric
+        self.header = "desc: %s\ncmd: %s\ntime_unit: us\n" % (description, command)
+        self.logs = {}
+        self.snapshot_ids = {}
+        self.task_lists = True
+
+    def get_process_tree(self):
+        pids = [self.root_pid]
+        position = 0
+        while position < len(pids):
+            pid = pids[position]
+            position += 1
+            try:
+                if self.task_lists:
+                    pids.extend(get_children_from_task_lists(pid))
+                else:
+                    pids.extend(get_children_from_stat(pid))
+            except (IOError, OSError):
+                if self.task_lists and os.path.exists("/proc/%d" % pid) \
+                        and not os.path.exists("/proc/%d/task/%d/children" % (pid, pid)):
+                    self.task_lists = False
+                    pids.extend(get_children_from_stat(pid))
+        return pids
+
+    def sample(self):
+        # One snapshot of every living process of the tree, all with the same timestamp.
+        timestamp = int(time.time() * 1000000)
+        sampled = set()
+        for pid in self.get_process_tree():
+            memory = read_status(pid)
+            if memory is None:
+                continue
+            rss, anon = memory
+            pss = read_pss(pid)
+            if pss is None:
+                pss = rss
+            self._write_snapshot(pid, timestamp, {"rss": rss, "pss": pss, "anon": anon})
+            sampled.add(pid)
+        for pid in list(self.logs):
+            if pid not in sampled:
+                self.logs.pop(pid).close()
+        return len(sampled)
+
+    def _write_snapshot(self, pid, timestamp, memory):
+        if pid not in self.logs:
+            if pid in self.snapshot_ids:
+                # The pid was reused by a new process, its snapshots go on in the same file.
+                self.logs[pid] = open(self.out_file.replace("%p", str(pid)), "a")
+            else:
+                self.logs[pid] = open(self.out_file.replace("%p", str(pid)), "w")
+                self.logs[pid].write(self.header)
+                self.snapshot_ids[pid] = 0
+        lines = ["#-----------", "snapshot=%d" % self.snapshot_ids[pid], "#-----------",
+                 "timestamp=%d" % timestamp,
+                 "mem_heap_B=%d" % memory[self.metric], "mem_heap_extra_B=0", "mem_stacks_B=0"]
+        lines.extend("mem_%s_B=%d" % (metric, memory[metric]) for metric in METRICS)
+        lines.append("heap_tree=empty")
+        self.logs[pid].write("\n".join(lines) + "\n")
+        self.logs[pid].flush()
+        self.snapshot_ids[pid] += 1
+
+    def close(self):
+        for log_file in self.logs.values():
+            log_file.close()
+        self.logs = {}
+
+
+def run_sampled(command, out_file, metric, interval):
+    process = subprocess.Popen(command)
+
+    def terminate(signal_number, frame):
+        if process.poll() is None:
+            process.send_signal(signal_number)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    description = "--interval=%g --metric=%s" % (interval, metric)
+    sampler = ProcessTreeSampler(process.pid, out_file, metric, description, " ".join(command))
+    try:
+        while process.poll() is None:
+            sampler.sample()
+            time.sleep(interval)
+    except (IOError, OSError):
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        raise
+    finally:
+        sampler.close()
+    return process.returncode
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Runs a command natively and samples the memory of its whole "
+                                                 "process tree from /proc into one massif-like file per process, "
+                                                 "which parse-logs.py can analyse.")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="the command to run, e.g. ./Minimal page.html")
+    parser.add_argument("-o", "--out-file", default=DEFAULT_OUT_FILE,
+                        help="output file of every process, %%p is replaced by its pid (default: %(default)s)")
+    parser.add_argument("-i", "--interval", type=float, default=0.05,
+                        help="seconds between two samples (default: %(default)s)")
+    parser.add_argument("-m", "--metric", choices=METRICS, default="pss",
+                        help="memory written as mem_heap_B, every metric is also written as mem_<metric>_B; "
+                             "pss falls back to rss without smaps_rollup (default: %(default)s)")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    command = arguments.command
+    if command and command[0] == "--":
+        command = command[1:]
+    if not command:
+        sys.stderr.write("No command was provided!\n")
+        exit(1)
+    try:
+        return_code = run_sampled(command, arguments.out_file, arguments.metric, arguments.interval)
+    except (IOError, OSError) as err:
+        sys.stderr.write("ERROR: %s\n" % str(err))
+        exit(1)
+    if return_code < 0:
+        return_code = 128 - return_code
+    exit(return_code)
+
+
+if __name__ == "__main__":
+    main()
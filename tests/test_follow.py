@@ -0,0 +1,89 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import benchmark
+SNAPSHOT_START = "#-----------\nsnapshot="
+
+
+def split_massif_file(file_name):
+    # The header and the (timestamp, text) pairs of the snapshots of a massif file.
+    with open(file_name, "r") as massif_file:
+        parts = massif_file.read().split(SNAPSHOT_START)
+    snapshots = []
+    for part in parts[1:]:
+        timestamp = int(part.split("timestamp=")[1].split("\n")[0])
+        snapshots.append((timestamp, SNAPSHOT_START + part))
+    return parts[0], snapshots
+
+
+@unittest.skipIf(not hasattr(sys, "maxint"), "parse-logs.py runs on Python 2")
+class FollowTest(unittest.TestCase):
+    def setUp(self):
+        self.parse_logs = benchmark.load_parse_logs()
+        self.measured = tempfile.mkdtemp()
+        self.followed = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.measured)
+        shutil.rmtree(self.followed)
+
+    def follow(self, case, window, snapshots_per_poll, truncated_child=False):
+        # Writes the snapshots of all files in time order, a few at a time, and polls in between.
+        file_names = benchmark.generate_measurement(self.measured, case)
+        followed_files = {}
+        snapshots = []
+        for file_name in file_names:
+            header, file_snapshots = split_massif_file(file_name)
+            followed_files[file_name] = open(os.path.join(self.followed, os.path.basename(file_name)), "w")
+            followed_files[file_name].write(header)
+            snapshots.extend((timestamp, file_name, text) for timestamp, text in file_snapshots)
+        snapshots.sort()
+        tracker = self.parse_logs.PeakTracker(os.path.join(self.followed, "1-.out"), window)
+        for start in range(0, len(snapshots), snapshots_per_poll):
+            for timestamp, file_name, text in snapshots[start:start + snapshots_per_poll]:
+                followed_files[file_name].write(text)
+                followed_files[file_name].flush()
+            tracker.poll()
+        if truncated_child:
+            followed_files[file_names[-1]].write(SNAPSHOT_START + "%d\n#-----------\ntime=1\n" % len(snapshots))
+        for followed_file in followed_files.values():
+            followed_file.close()
+        tracker.finish()
+        return file_names, tracker.get_peak_heap()
+
+    def get_batch_peak(self, file_names):
+        output_list = [self.parse_logs.MassifOutput(file_name) for file_name in file_names]
+        return self.parse_logs.ResultGenerator(output_list).get_useful_memory()
+
+    def get_case(self, seed, children):
+        return {"seed": seed, "duration": 60, "snapshots": 300, "depth": 2, "detailed_frequency": 10,
+                "size": None, "overlap": 0.8, "children": children}
+
+    def test_streamed_peak_matches_whole_files(self):
+        for seed in range(1, 4):
+            case = self.get_case(seed, 2)
+            file_names, streamed_peak = self.follow(case, 64, 5)
+            file_names, whole_peak = self.follow(case, 100000, 100000)
+            self.assertEqual(streamed_peak, whole_peak)
+            # The follower sums the nearest snapshots instead of matching whole vectors.
+            batch_peak = self.get_batch_peak(file_names)
+            self.assertLess(abs(streamed_peak - batch_peak), batch_peak * 0.01)
+
+    def test_small_window(self):
+        case = self.get_case(3, 4)
+        file_names, streamed_peak = self.follow(case, 8, 3)
+        file_names, whole_peak = self.follow(case, 100000, 100000)
+        self.assertEqual(streamed_peak, whole_peak)
+
+    def test_truncated_child(self):
+        case = self.get_case(1, 2)
+        file_names, truncated_peak = self.follow(case, 64, 5, True)
+        file_names, complete_peak = self.follow(case, 64, 5)
+        self.assertEqual(truncated_peak, complete_peak)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import benchmark
+
+
+class SplitArchivePathTest(unittest.TestCase):
+    def setUp(self):
+        self.parse_logs = benchmark.load_parse_logs()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_absolute_path(self):
+        file_name = os.path.join(self.directory, "missing", "1-.out1")
+        self.assertEqual(self.parse_logs.split_archive_path(file_name), (None, file_name))
+        self.assertEqual(self.parse_logs.split_archive_path("/nonexistent/1-.out1"), (None, "/nonexistent/1-.out1"))
+
+    def test_missing_relative_path(self):
+        self.assertEqual(self.parse_logs.split_archive_path("missing/1-.out1"), (None, "missing/1-.out1"))
+
+    def test_archive_member(self):
+        member = os.path.join(self.directory, "1-.out1")
+        with open(member, "w") as member_file:
+            member_file.write("desc: none\n")
+        archive = os.path.join(self.directory, "site.tar")
+        with tarfile.open(archive, "w") as tar:
+            tar.add(member, "1-.out1")
+        self.assertEqual(self.parse_logs.split_archive_path(os.path.join(archive, "1-.out1")),
+                         (archive, "1-.out1"))
+
+    def test_diff_run_prefix_in_archive(self):
+        for file_name in ("1-.out10", "1-.out11", "5-.out10"):
+            with open(os.path.join(self.directory, file_name), "w") as member_file:
+                member_file.write("desc: none\n")
+        archive = os.path.join(self.directory, "site.tar")
+        with tarfile.open(archive, "w") as tar:
+            for file_name in ("1-.out10", "1-.out11", "5-.out10"):
+                tar.add(os.path.join(self.directory, file_name), file_name)
+        self.assertEqual(self.parse_logs.get_diff_runs(os.path.join(archive, "1-")),
+                         [(1, [os.path.join(archive, "1-.out10"), os.path.join(archive, "1-.out11")])])
+
+
+if __name__ == "__main__":
+    unittest.main()